@@ -0,0 +1,314 @@
+"""Benchmark the scheduler and query layer against a large synthetic population
+
+Seeds a throwaway SQLite database with guilds and channels spread over mixed
+timezones and days patterns, then drives the scheduler over a simulated stretch
+of time against fake Discord guilds and channels.
+
+usage: python benchmark.py --guilds 10000 --channels 20 --ticks 240 --step 60
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import time as dtime
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+ZONES = (
+    None,
+    "UTC",
+    "America/New_York",
+    "America/Los_Angeles",
+    "Europe/London",
+    "Europe/Berlin",
+    "Asia/Kolkata",
+    "Asia/Tokyo",
+    "Australia/Sydney",
+)
+DAYS = (None, "0-4", "5-6", "0,2,4", "1-3", "6", "5-1")
+
+
+class FakeRole:
+    """Stands in for a guild's @everyone role"""
+
+
+class FakeTextChannel:
+    """Stands in for a disnake TextChannel, API calls only touch local state"""
+
+    def __init__(self, guild: "FakeGuild", channel_id: int) -> None:
+        self.guild = guild
+        self.id = channel_id
+        self.name = f"channel-{channel_id}"
+        self.send_messages: Optional[bool] = None
+
+    def overwrites_for(self, target) -> "FakeTextChannel":
+        # the channel doubles as its own @everyone overwrite
+        return self
+
+    async def set_permissions(self, target, *, send_messages: Optional[bool]) -> None:
+        self.send_messages = send_messages
+
+    async def edit(self, *, name: str) -> None:
+        self.name = name
+
+
+class FakeGuild:
+    """Stands in for a disnake Guild, channels are created on first access"""
+
+    def __init__(self, guild_id: int) -> None:
+        self.id = guild_id
+        self.default_role = FakeRole()
+        self._channels: dict[int, FakeTextChannel] = {}
+
+    def get_channel(self, channel_id: int) -> FakeTextChannel:
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = FakeTextChannel(self, channel_id)
+        return channel
+
+
+class FakeClient:
+    """Replaces the bot's guild lookup"""
+
+    def __init__(self) -> None:
+        self.guilds: dict[int, FakeGuild] = {}
+
+    def get_guild(self, guild_id: int) -> FakeGuild:
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = FakeGuild(guild_id)
+        return guild
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of the values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def channel_id(transition) -> int:
+    """Sort key for scheduler transitions"""
+    return transition.channel.channel_id
+
+
+def peak_memory_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB everywhere else
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+async def seed(guilds: int, channels: int, rng: random.Random) -> None:
+    """Fill the guild and channel tables with a synthetic population"""
+
+    from sqlalchemy import insert
+
+    from bot.config.model import Channel, Guild, days_mask, engine
+
+    guild_rows = []
+    channel_rows = []
+    for g in range(guilds):
+        # spread the guilds over shards the way Discord snowflakes do
+        guild_id = (rng.randrange(1 << 20) << 22) | g
+        guild_rows.append({"id": guild_id, "timezone": rng.choice(ZONES)})
+
+        for c in range(channels):
+            days = rng.choice(DAYS)
+            channel_rows.append(
+                {
+                    "guild": guild_id,
+                    "channel_id": guild_id * 100 + c,
+                    "time_lock": dtime(rng.randrange(24), rng.choice((0, 15, 30, 45))),
+                    "time_unlock": dtime(rng.randrange(24), rng.choice((0, 30))),
+                    "unlocked": True,
+                    "days": days,
+                    "days_mask": days_mask(days),
+                }
+            )
+
+    async with engine.begin() as conn:
+        for table, rows in ((Guild, guild_rows), (Channel, channel_rows)):
+            for i in range(0, len(rows), 5000):
+                await conn.execute(insert(table), rows[i : i + 5000])
+
+
+async def bench(args: argparse.Namespace) -> None:
+    """Run every benchmark phase and print the report"""
+
+    from sqlalchemy import event
+
+    from bot.config import cache, migrations, model, query
+    from bot.scheduler import vectorized
+
+    bot_module = importlib.import_module("bot.bot")
+    scheduler = bot_module.scheduler
+    client = FakeClient()
+    bot_module.bot.get_guild = client.get_guild
+
+    round_trips = 0
+
+    def count_round_trip(*_) -> None:
+        nonlocal round_trips
+        round_trips += 1
+
+    event.listen(model.engine.sync_engine, "before_cursor_execute", count_round_trip)
+
+    rng = random.Random(args.seed)
+    report = []
+
+    def phase(name: str, start: float, trips: int, extra: str = "") -> None:
+        report.append(
+            f"{name:<24}{time.perf_counter() - start:>9.3f}s"
+            f"{round_trips - trips:>8} round trips  {extra}"
+        )
+
+    start, trips = time.perf_counter(), round_trips
+    await migrations.migrate()
+    await seed(args.guilds, args.channels, rng)
+    phase("seed", start, trips, f"{args.guilds} guilds x {args.channels} channels")
+
+    start, trips = time.perf_counter(), round_trips
+    await cache.load()
+    phase("cache warm", start, trips)
+
+    start, trips = time.perf_counter(), round_trips
+    scheduler.load()
+    phase("scheduler load", start, trips, f"{len(scheduler)} scheduled")
+
+    # the startup path: schedule each streamed chunk as it arrives
+    start, trips = time.perf_counter(), round_trips
+    scheduler.clear()
+    async for channels in cache.stream_load(chunk_size=args.chunk_size):
+        scheduler.schedule_channels(c.channel_id for c in channels)
+    phase("streamed load", start, trips, f"{len(scheduler)} scheduled")
+
+    # silence the per-batch summary printed by lock_unlock_channel
+    with contextlib.redirect_stdout(io.StringIO()):
+        start, trips = time.perf_counter(), round_trips
+        reconciled = await scheduler.reconcile()
+        phase("reconcile", start, trips, f"{reconciled} out of sync")
+
+    # desired state evaluation alone, per-channel loop against NumPy arrays
+    later = time.time() + 3 * 3600
+    start, trips = time.perf_counter(), round_trips
+    looped = scheduler.out_of_sync(later, vectorized=False)
+    phase("evaluate (loop)", start, trips, f"{len(looped)} out of sync")
+
+    if vectorized.available():
+        start, trips = time.perf_counter(), round_trips
+        batched = scheduler.out_of_sync(later, vectorized=True)
+        agrees = sorted(looped, key=channel_id) == sorted(batched, key=channel_id)
+        phase(
+            "evaluate (vectorized)",
+            start,
+            trips,
+            f"{len(batched)} out of sync, {'matches' if agrees else 'DIFFERS from'} loop",
+        )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies = []
+        trips_per_tick = []
+        due = 0
+        now = time.time()
+
+        for i in range(1, args.ticks + 1):
+            trips = round_trips
+            tick_start = time.perf_counter()
+            due += await scheduler.tick(now + i * args.step)
+            latencies.append(time.perf_counter() - tick_start)
+            trips_per_tick.append(round_trips - trips)
+
+    start, trips = time.perf_counter(), round_trips
+    guild_ids = [g.id for g in cache.guilds()]
+    for guild_id in rng.sample(guild_ids, min(len(guild_ids), 1000)):
+        await query.get_guild_config(guild_id)
+    phase("get_guild_config x1000", start, trips)
+
+    start, trips = time.perf_counter(), round_trips
+    await query.get_guild_configs()
+    phase("get_guild_configs", start, trips)
+
+    # memory still held by the loaded channels, ORM rows against cache records
+    tracemalloc.start()
+    orm_channels = [c for g in await query.get_guild_configs() for c in g.channels]
+    orm_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    rows = [
+        (c.guild, c.channel_id, c.time_lock, c.time_unlock, c.unlocked, c.days)
+        for c in orm_channels
+    ]
+    del orm_channels
+
+    tracemalloc.start()
+    records = [cache.ChannelConfig(*row) for row in rows]
+    record_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records, rows
+
+    channel_ids = [c for g in cache.guilds() for c in g.channels]
+    statuses = [(c, rng.random() < 0.5) for c in rng.sample(channel_ids, 1000)]
+    start, trips = time.perf_counter(), round_trips
+    await query.update_channel_statuses(statuses)
+    phase("update_channel_statuses", start, trips, "1000 channels")
+
+    total = sum(latencies)
+    channel_count = args.guilds * args.channels
+
+    def per_100k(size: int) -> float:
+        return size / 1024**2 * 100_000 / channel_count if channel_count else 0.0
+
+    print("\n".join(report))
+    print(
+        f"\nticks: {args.ticks} x {args.step}s simulated, {due} due channels\n"
+        f"ticks/sec: {args.ticks / total if total else float('inf'):.1f}\n"
+        f"tick latency: p50 {percentile(latencies, 0.5) * 1000:.3f}ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.2f}ms, "
+        f"max {max(latencies) * 1000:.2f}ms\n"
+        f"db round trips per tick: mean {sum(trips_per_tick) / len(trips_per_tick):.2f}, "
+        f"max {max(trips_per_tick)}\n"
+        f"memory per 100k channels: orm rows {per_100k(orm_bytes):.1f}MB, "
+        f"cache records {per_100k(record_bytes):.1f}MB\n"
+        f"peak memory: {peak_memory_mb() or 0:.1f}MB"
+    )
+
+    # pooled SQLite connections run in threads that would keep the process alive
+    await model.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=20, help="channels per guild")
+    parser.add_argument("--ticks", type=int, default=240)
+    parser.add_argument(
+        "--step", type=int, default=60, help="simulated seconds between ticks"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--chunk-size", type=int, default=1000, help="rows per streamed chunk"
+    )
+    args = parser.parse_args()
+
+    if args.ticks < 1:
+        parser.error("--ticks must be at least 1")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # point the bot at a throwaway database before it is imported
+        database = os.path.join(directory, "benchmark.sqlite3")
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{database}"
+        asyncio.run(bench(args))
@@ -1,18 +1,49 @@
-from audioop import add
-from datetime import datetime, timedelta
+import asyncio
+import time
+from datetime import datetime
+from functools import partial
 from sys import version as sys_version
+from typing import Awaitable
 
-import pytz
 from disnake import Activity, ActivityType, Guild, Intents, TextChannel
+from disnake.abc import GuildChannel
 from disnake import __version__ as disnake_version
 from disnake.ext import commands, tasks
 
 from bot import __version__ as bot_version
+from bot import metrics, settings, startup
 from bot.cogs import Config
-from bot.cogs.helper import helper
-from bot.config import query
+from bot.config import cache, model
+from bot.scheduler import (
+    ActionExecutor,
+    Leases,
+    RenameQueue,
+    Scheduler,
+    Transition,
+    journal,
+    planner,
+)
+from bot.scheduler.lease import COORDINATION_MODES
+
+
+class Bot(commands.AutoShardedInteractionBot):
+    """The bot, closing its database connections when it shuts down"""
+
+    async def close(self) -> None:
+        await super().close()
+
+        try:
+            await cache.flush_channel_statuses()
+        except Exception as e:
+            print(f"Failed to store channel statuses on shutdown: {e!r}")
+
+        # pooled SQLite connections run in threads that would keep the process alive
+        await model.engine.dispose()
 
-bot = commands.InteractionBot(
+
+bot = Bot(
+    shard_ids=settings.SHARD_IDS,
+    shard_count=settings.SHARD_COUNT,
     intents=Intents.default(),
     test_guilds=[947543739671412878],
     activity=Activity(type=ActivityType.watching, name="/help"),
@@ -31,12 +62,60 @@ async def bot_ready() -> None:
         f""
         "--------------------------\n"
         f"Successfully connected to Discord as: {bot.user} ({bot.user.id})\n"
+        f"Shards: {bot.shard_ids or 'all'} of {bot.shard_count}\n"
         "--------------------------"
     )
 
     await bot.wait_until_ready()
-    lock_unlock_channel.start()
-    add_guilds.start()
+    if not run_scheduler.is_running():
+        startup.mark("gateway ready")
+        run_scheduler.start()
+        flush_renames.start()
+        prune_journal.start()
+
+        if settings.METRICS_PORT:
+            await metrics.start_server(settings.METRICS_HOST, settings.METRICS_PORT)
+            print(
+                f"Serving metrics on http://{settings.METRICS_HOST}:{settings.METRICS_PORT}/metrics"
+            )
+    else:
+        await reconcile_channels()
+
+
+@bot.listen(name="on_resumed")
+async def bot_resumed() -> None:
+    """Invoked when the gateway session resumes after a disconnect"""
+    if run_scheduler.is_running():
+        await reconcile_channels()
+
+
+@bot.listen(name="on_guild_join")
+async def guild_joined(guild: Guild) -> None:
+    """Invoked when the bot is added to a guild"""
+    await cache.add_guild(guild.id)
+
+
+@bot.listen(name="on_guild_remove")
+async def guild_removed(guild: Guild) -> None:
+    """Invoked when the bot is removed from a guild, or the guild is deleted
+    Purges the guild's config so nothing is scheduled for it anymore"""
+
+    channel_ids = await cache.remove_guild(guild.id)
+    scheduler.remove_channels(channel_ids)
+    for channel_id in channel_ids:
+        renames.discard(channel_id)
+
+
+@bot.listen(name="on_guild_channel_delete")
+async def channel_deleted(channel: GuildChannel) -> None:
+    """Invoked when a channel is deleted, drops it from the config and schedule"""
+
+    if cache.get_channel(channel.id) is None:
+        return
+
+    await cache.remove_channel(channel.id)
+    scheduler.remove_channel(channel.id)
+    renames.discard(channel.id)
 
 
 # load cogs
@@ -48,78 +127,303 @@ Asyncio tasks
 """
 
 
-@tasks.loop(seconds=30)
-async def lock_unlock_channel() -> None:
-    """Asyncio loop that runs every 5 minutes and checks if the
-    current time is greater than the configured time to lock or unlock
-    the configured channels"""
-
-    # fetch all guilds and their config channels from the database
-    guilds = await query.get_guild_configs()
-
-    for _guild_ in guilds:
-        # get discord guild object for getting channel
-        # objects later
-        guild: Guild = bot.get_guild(_guild_.id)
-        # set timezone objects from guild config
-        timezone: str = "UTC" if _guild_.timezone is None else _guild_.timezone
-        tz = pytz.timezone(timezone)
-        now = datetime.now(tz)
-
-        for _channel_ in _guild_.channels:
-            # get time data from db and convert to localized tz datetime objects
-            unlocked = _channel_.unlocked
-            local_lock_time = helper.combine_date_time(
-                now.date(), _channel_.time_lock, tz
-            )
-            local_lock_time_30_seconds = local_lock_time + timedelta(seconds=30)
-            local_unlock_time = helper.combine_date_time(
-                now.date(), _channel_.time_unlock, tz
+async def discord_call(route: str, call: Awaitable) -> None:
+    """Await a Discord API call, counting it and any error it raises"""
+
+    metrics.DISCORD_CALLS.inc(route=route)
+    try:
+        await call
+    except Exception:
+        metrics.DISCORD_ERRORS.inc(route=route)
+        raise
+
+
+async def set_channel_status(channel: TextChannel, *, unlock: bool, when: int) -> None:
+    """Lock or unlock a discord channel and record its new status
+    Only the calls that would change something are made"""
+
+    metrics.ACTION_LATENESS.observe(max(0, time.time() - when))
+    plan = planner.plan(channel, unlock)
+
+    # lock or unlock channel
+    if plan.update_permissions:
+        await discord_call(
+            "set_permissions",
+            channel.set_permissions(
+                channel.guild.default_role, overwrite=plan.overwrite
+            ),
+        )
+    else:
+        metrics.DISCORD_SKIPPED.inc(route="set_permissions")
+
+    # update channel locked status, as soon as the permissions are in place
+    await cache.update_channel_status(channel.id, is_unlocked=unlock)
+    metrics.CHANNELS.inc(result="unlocked" if unlock else "locked")
+
+    # update channel name, sent after the batch within the rename rate limit
+    renames.request(channel, plan.name)
+
+
+async def set_category_status(plan: planner.CategoryPlan, *, when: int) -> None:
+    """Lock or unlock a category's synced channels through the category overwrite
+    Overwrites do not propagate to existing channels, so each one is re-synced in
+    an edit that also carries its rename"""
+
+    metrics.ACTION_LATENESS.observe(max(0, time.time() - when))
+    category = plan.category
+
+    if plan.update_permissions:
+        await discord_call(
+            "set_permissions",
+            category.set_permissions(
+                category.guild.default_role, overwrite=plan.overwrite
+            ),
+        )
+    else:
+        metrics.DISCORD_SKIPPED.inc(route="set_permissions")
+
+    for channel, channel_plan in plan.channels:
+        if plan.update_permissions:
+            edit = {"sync_permissions": True}
+            if renames.take(channel, channel_plan.name):
+                edit["name"] = channel_plan.name
+            await discord_call("edit", channel.edit(**edit))
+        else:
+            metrics.DISCORD_SKIPPED.inc(route="set_permissions")
+            renames.request(channel, channel_plan.name)
+
+        await cache.update_channel_status(channel.id, is_unlocked=plan.unlock)
+        metrics.CHANNELS.inc(result="unlocked" if plan.unlock else "locked")
+
+
+async def lock_unlock_channel(transitions: list[Transition]) -> None:
+    """Invoked by the scheduler with the channels whose configured
+    lock or unlock time has been reached"""
+
+    # guild_id -> [(channel, unlock)]
+    targets: dict[int, list[tuple[TextChannel, bool]]] = {}
+    due: dict[int, int] = {}
+    journaled = []
+    for transition in transitions:
+        _channel_ = transition.channel
+
+        # another process holds the lease of the guild's shard
+        if not owns(_channel_.guild):
+            metrics.CHANNELS.inc(result="standby")
+            continue
+
+        # skip channels that are already in the requested state
+        if transition.unlock == _channel_.unlocked:
+            metrics.CHANNELS.inc(result="skipped")
+            continue
+
+        # get discord guild object for getting channel objects
+        guild: Guild = bot.get_guild(_channel_.guild)
+        channel: TextChannel = guild and guild.get_channel(_channel_.channel_id)
+        if channel is None:
+            metrics.CHANNELS.inc(result="missing")
+            continue
+
+        targets.setdefault(guild.id, []).append((channel, transition.unlock))
+        due[channel.id] = transition.when
+        journaled.append(transition)
+
+    actions = []
+    for guild_id, channels in targets.items():
+        # in category mode synced channels may share one category update
+        config = cache.get_guild(guild_id)
+        if config is not None and config.category_mode:
+            plans, channels = planner.group(channels, ready=renames.ready)
+            for plan in plans:
+                when = min(due[c.id] for c, _ in plan.channels)
+                actions.append(
+                    (
+                        guild_id,
+                        plan.category.id,
+                        partial(set_category_status, plan, when=when),
+                    )
+                )
+
+        for channel, unlock in channels:
+            actions.append(
+                (
+                    guild_id,
+                    channel.id,
+                    partial(
+                        set_channel_status,
+                        channel,
+                        unlock=unlock,
+                        when=due[channel.id],
+                    ),
+                )
             )
-            local_unlock_time_30_seconds = local_unlock_time + timedelta(seconds=30)
 
-            weekday = now.weekday()
+    if not actions:
+        return
+
+    # journal the actions first so an interrupted batch is replayed on startup
+    try:
+        await journal.record(journaled)
+    except Exception as e:
+        print(f"Failed to journal {len(journaled)} action(s): {e!r}")
+
+    results = await executor.run(actions)
+
+    for result in results:
+        metrics.ACTION_SECONDS.observe(result.latency)
+        if result.error is not None:
+            metrics.CHANNELS.inc(result="failed")
+            print(f"Failed to update channel {result.key}: {result.error!r}")
 
-            # split channels days or date range  into comparable weekdays
-            c_days = _channel_.days
+    latencies = sorted(r.latency for r in results)
+    print(
+        f"Updated {len(journaled)} channel(s) with {len(results)} action(s) "
+        f"in {len({r.guild_id for r in results})} guild(s): "
+        f"median {latencies[len(latencies) // 2]:.2f}s, slowest {latencies[-1]:.2f}s"
+    )
 
-            if not helper.should_run(c_days, weekday):
-                continue
+    # the batch's renames go out once its permissions are set, in the background
+    # so that rate limited renames never hold up the next batch
+    if renames.mode == "immediate" and len(renames):
+        task = asyncio.create_task(renames.flush(owns))
+        _rename_flushes.add(task)
+        task.add_done_callback(_rename_flushes.discard)
 
-            # check if channel is ready to be locked
-            if local_lock_time <= now <= local_lock_time_30_seconds and unlocked:
 
-                # lock channel
-                channel: TextChannel = guild.get_channel(_channel_.channel_id)
-                await channel.set_permissions(guild.default_role, send_messages=False)
+async def rename_channel(channel: TextChannel, name: str) -> None:
+    """Rename a discord channel"""
+    await discord_call("edit", channel.edit(name=name))
 
-                # update channel name
-                name = channel.name.replace("🔴", "").replace("🟢", "")
-                await channel.edit(name=f"🔴{name}🔴")
 
-                # update channel locked status
-                await query.update_channel_status(channel.id, is_unlocked=False)
+executor = ActionExecutor()
+renames = RenameQueue(executor, rename_channel, mode=settings.RENAME_MODE)
+# rename flushes started after a batch, referenced until they finish
+_rename_flushes: set[asyncio.Task] = set()
+scheduler = Scheduler(lock_unlock_channel, vectorized=settings.SCHEDULER_VECTORIZED)
+bot.scheduler = scheduler
 
-            # check if channel is ready to be unlocked
-            if (
-                local_unlock_time <= now <= local_unlock_time_30_seconds
-                and not unlocked
-            ):
-                # unlock channel
-                channel: TextChannel = guild.get_channel(_channel_.channel_id)
-                await channel.set_permissions(guild.default_role, send_messages=None)
+if settings.COORDINATION not in COORDINATION_MODES:
+    raise ValueError(f"COORDINATION must be one of {', '.join(COORDINATION_MODES)}")
 
-                # update channel name
-                name = channel.name.replace("🟢", "").replace("🔴", "")
-                await channel.edit(name=f"🟢{name}🟢")
+# shard leases, only used when several processes run for the same shards
+leases = (
+    Leases(settings.INSTANCE_ID, ttl=settings.LEASE_TTL, margin=settings.LEASE_MARGIN)
+    if settings.COORDINATION == "lease"
+    else None
+)
 
-                # update channel locked status
-                await query.update_channel_status(channel.id, is_unlocked=True)
+
+def owns(guild_id: int) -> bool:
+    """True if this process schedules the guild, always without coordination"""
+    return leases is None or leases.owns(guild_id)
 
 
 @tasks.loop(count=1)
-async def add_guilds():
-    """Adds any new guilds that were added to the bot while offline"""
+async def run_scheduler() -> None:
+    """Warms the config cache, loads every configured channel into the scheduler
+    and sleeps until the next lock or unlock is due, instead of polling the database"""
+
+    # only schedule the guilds that belong to this process' shards,
+    # channels are scheduled chunk by chunk as the cache is streamed in
+    scheduler.clear()
+    async for channels in cache.stream_load(bot.shard_ids, bot.shard_count):
+        scheduler.schedule_channels(c.channel_id for c in channels)
+
+    # add any new guilds that were added to the bot while offline
+    await cache.add_guilds(guild.id for guild in bot.guilds)
+    startup.mark("cache warm")
+
+    # with coordination, only act on the shards whose leases this process holds,
+    # a standby replays the journal in take_over once it gains a lease
+    gained: set[int] = set()
+    if leases is not None:
+        gained = await renew_leases()
+        hold_leases.start()
+
+    # finish the actions an earlier process was interrupted in
+    if leases is None or gained:
+        await replay_journal()
+
+    await reconcile_channels()
+    startup.mark("scheduler armed")
+
+    await scheduler.run()
+
+
+async def replay_journal() -> None:
+    """Finish the actions an earlier process was interrupted in, for the guilds
+    this process acts on"""
+
+    replayed = await journal.replay(
+        scheduler,
+        bot.shard_ids,
+        bot.shard_count,
+        owns=owns,
+        batch_size=settings.JOURNAL_REPLAY_BATCH,
+    )
+    if replayed:
+        print(f"Replayed {replayed} interrupted channel action(s)")
+
+
+async def reconcile_channels() -> None:
+    """Fix any channel left in the wrong state by downtime or a missed transition"""
+
+    count = await scheduler.reconcile()
+    if count:
+        print(f"Reconciled {count} channel(s) with their schedule")
+
+
+@tasks.loop(seconds=settings.RENAME_INTERVAL)
+async def flush_renames() -> None:
+    """Sends the channel renames that were queued by the rate limit or deferred mode"""
+
+    await renames.flush(owns)
+
+
+@tasks.loop(hours=1)
+async def prune_journal() -> None:
+    """Delete completed action journal entries past their retention"""
+    await journal.prune(settings.JOURNAL_RETENTION * 3600)
+
+
+async def renew_leases() -> set[int]:
+    """Renew this process' shard leases, returns the shards it took over"""
+
+    shard_count = bot.shard_count or 1
+    gained, lost = await leases.heartbeat(
+        bot.shard_ids or range(shard_count), shard_count
+    )
+
+    if lost:
+        print(f"Lost the lease of shard(s) {sorted(lost)}, standing by")
+    if gained:
+        print(f"Holding the lease of shard(s) {sorted(gained)}")
+    return gained
+
+
+async def take_over() -> None:
+    """Reload the channel statuses the previous lease holder changed, then finish
+    its interrupted actions and fix any channel it left behind"""
+
+    await cache.flush_channel_statuses()
+    scheduler.clear()
+    async for channels in cache.stream_load(bot.shard_ids, bot.shard_count):
+        scheduler.schedule_channels(c.channel_id for c in channels)
+
+    await replay_journal()
+
+    await reconcile_channels()
+
+
+@tasks.loop(seconds=settings.LEASE_HEARTBEAT)
+async def hold_leases() -> None:
+    """Keeps this process' shard leases and takes over the ones that lapsed"""
+
+    try:
+        gained = await renew_leases()
+    except Exception as e:
+        print(f"Failed to renew shard leases: {e!r}")
+        return
 
-    for guild in bot.guilds:
-        await query.add_guild(guild.id)
+    if gained:
+        await take_over()
@@ -1,11 +1,29 @@
+import io
 from datetime import time
 from typing import Optional
 
 import pytz
-from bot.cogs.helper import helper
-from bot.config import query
-from disnake import ApplicationCommandInteraction, Color, Embed, TextChannel, utils
-from disnake.ext.commands import Cog, default_member_permissions, slash_command
+from bot.cogs.helper import config_file, config_view, helper
+from bot.cogs.helper.autocomplete import ChannelNameIndex
+from bot.config import cache
+from disnake import (
+    ApplicationCommandInteraction,
+    Attachment,
+    Color,
+    Embed,
+    File,
+    Guild,
+    TextChannel,
+    abc,
+)
+from disnake.ext.commands import (
+    Cog,
+    NotOwner,
+    Param,
+    default_member_permissions,
+    is_owner,
+    slash_command,
+)
 from disnake.ui import Button, View
 
 
@@ -15,12 +33,52 @@ class Config(Cog):
     def __init__(self, bot) -> None:
         self.bot = bot
         self.days = ("mon", "tues", "wed", "thurs", "fri", "sat", "sun")
+        # configured channel names per guild, for the remove channel picker
+        self.names = ChannelNameIndex()
+        # rendered /config view per guild
+        self.views = config_view.ConfigViews()
 
     @Cog.listener(name="on_ready")
     async def loaded_cog(self) -> None:
         """Invoked when this cog is loaded"""
         print(f"Cog loaded: {self.qualified_name}")
 
+    @Cog.listener()
+    async def on_guild_channel_update(
+        self, before: abc.GuildChannel, after: abc.GuildChannel
+    ) -> None:
+        """Keep the name index and rendered view in step with renamed configured
+        channels"""
+        if before.name != after.name and cache.get_channel(after.id) is not None:
+            self.names.add(after.guild.id, after.id, after.name)
+            self.views.discard(after.guild.id)
+
+    @Cog.listener()
+    async def on_guild_channel_delete(self, channel: abc.GuildChannel) -> None:
+        """Drop deleted channels from the name index"""
+        self.names.discard(channel.guild.id, channel.id)
+
+    @Cog.listener()
+    async def on_guild_remove(self, guild: Guild) -> None:
+        """Drop the name index and rendered view of guilds the bot has left"""
+        self.names.forget(guild.id)
+        self.views.discard(guild.id)
+
+    def _index_guild(self, guild: Guild) -> bool:
+        """Build the guild's name index from the cache if it is not built yet
+        Returns False if the guild's config is not cached"""
+
+        if guild.id in self.names:
+            return True
+
+        config = cache.get_guild(guild.id)
+        if config is None:
+            return False
+
+        channels = (guild.get_channel(i) for i in config.channels)
+        self.names.build(guild.id, ((c.id, c.name) for c in channels if c is not None))
+        return True
+
     @slash_command(name="config")
     # @default_member_permissions(manage_channels=True)
     async def config(self, interaction: ApplicationCommandInteraction) -> None:
@@ -33,14 +91,42 @@ class Config(Cog):
         View the current configuration for this server
         """
 
-        guild = await query.get_guild_config(interaction.guild.id)
+        guild = await cache.get_guild_config(interaction.guild.id)
         slash_guild = interaction.guild
 
-        # create and format the embed showing command guild's current config
-        embed = helper.guild_config_info(slash_guild, guild)
+        # rendered once per config version, long channel tables are paged
+        pages = self.views.get(slash_guild, guild)
+        if pages.has(1):
+            return await interaction.response.send_message(
+                embed=pages.embed(0), view=config_view.PageView(pages), ephemeral=True
+            )
+
+        await interaction.response.send_message(embed=pages.embed(0), ephemeral=True)
+
+    @config.sub_command(name="stats")
+    # bot-wide internals, sub-commands can not have default member permissions
+    @is_owner()
+    async def config_stats(self, interaction: ApplicationCommandInteraction) -> None:
+        """
+        View scheduler, query and Discord API statistics for this bot process
+        """
+
+        embed = helper.stats_info(len(self.bot.scheduler))
 
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
+    @config_stats.error
+    async def config_stats_error(
+        self, interaction: ApplicationCommandInteraction, error: Exception
+    ) -> None:
+        """Invoked when /config stats fails, e.g. for anyone but the bot owner"""
+        if not isinstance(error, NotOwner):
+            raise error
+
+        await interaction.response.send_message(
+            "Only the bot owner can view its statistics", ephemeral=True
+        )
+
     @config.sub_command_group(name="set")
     async def config_set_sub_command_group(
         self, interaction: ApplicationCommandInteraction
@@ -75,12 +161,31 @@ class Config(Cog):
             )
 
         guild = interaction.guild
-        await query.update_guild_timezone(guild.id, timezone)
+        await cache.update_guild_timezone(guild.id, timezone)
+        self.bot.scheduler.schedule_guild(guild.id)
 
         await interaction.response.send_message(
             f"Timezone has been updated", ephemeral=True
         )
 
+    @config_set_sub_command_group.sub_command(name="category_mode")
+    async def config_set_category_mode(
+        self, interaction: ApplicationCommandInteraction, enabled: bool
+    ) -> None:
+        """Lock channels that share a category and schedule through the category
+
+        Parameters
+        ----------
+        enabled: Lock channels synced with their category in one category update
+        """
+
+        await cache.update_guild_category_mode(interaction.guild.id, enabled)
+
+        await interaction.response.send_message(
+            f"Category mode has been {'enabled' if enabled else 'disabled'}",
+            ephemeral=True,
+        )
+
     @config_set_sub_command_group.sub_command(name="channel")
     async def config_add_update_channel(
         self,
@@ -144,13 +249,15 @@ class Config(Cog):
                     ephemeral=True,
                 )
 
-        add, lock, unlock, days = await query.update_guild_channel(
+        add, lock, unlock, days = await cache.update_guild_channel(
             guild.id,
             channel_id=channel.id,
             time_lock=time_lock,
             time_unlock=time_unlock,
             days=days,
         )
+        self.bot.scheduler.schedule_channel(channel.id)
+        self.names.add(guild.id, channel.id, channel.name)
 
         if add:
             msg = "**New Channel Added!**\n"
@@ -169,6 +276,218 @@ class Config(Cog):
             ephemeral=True,
         )
 
+    @config.sub_command(name="export")
+    async def config_export(
+        self,
+        interaction: ApplicationCommandInteraction,
+        format: str = Param("json", choices=list(config_file.FORMATS)),
+    ) -> None:
+        """Download this server's channel config as a file
+
+        Parameters
+        ----------
+        format: json (the whole config) or csv (only the channels' lock/unlock times)
+        """
+
+        guild = interaction.guild
+        config = await cache.get_guild_config(guild.id)
+        data = config_file.export(guild, config, format)
+
+        await interaction.response.send_message(
+            f"{len(config.channels)} configured channel(s)",
+            file=File(io.BytesIO(data), filename=f"channelstatus-{guild.id}.{format}"),
+            ephemeral=True,
+        )
+
+    @config.sub_command(name="import")
+    async def config_import(
+        self,
+        interaction: ApplicationCommandInteraction,
+        file: Attachment,
+        replace: bool = False,
+    ) -> None:
+        """Configure many channels at once from an exported JSON or CSV file
+
+        Parameters
+        ----------
+        file: A file written by /config export, channels without windows in it keep theirs
+        replace: Also remove configured channels that the file does not list
+        """
+
+        guild = interaction.guild
+        await interaction.response.defer(ephemeral=True)
+
+        try:
+            parsed = config_file.parse(guild, file.filename, await file.read())
+        except config_file.ConfigFileError as e:
+            errors = "\n".join(e.errors[:15])
+            more = len(e.errors) - 15
+            return await interaction.followup.send(
+                "Nothing was imported, please fix the file:\n"
+                f"```\n{errors}```" + (f"\n...and {more} more" if more > 0 else ""),
+                ephemeral=True,
+            )
+
+        diff = await cache.import_channels(
+            guild.id,
+            parsed.channels,
+            timezone=parsed.timezone,
+            category_mode=parsed.category_mode,
+            windows=parsed.windows,
+            replace=replace,
+        )
+
+        if parsed.timezone is not None:
+            self.bot.scheduler.schedule_guild(guild.id)
+        else:
+            self.bot.scheduler.schedule_channels(diff["added"] + diff["changed"])
+        self.bot.scheduler.remove_channels(diff["removed"])
+
+        for channel_id in diff["added"]:
+            self.names.add(guild.id, channel_id, guild.get_channel(channel_id).name)
+        for channel_id in diff["removed"]:
+            self.names.discard(guild.id, channel_id)
+
+        await interaction.followup.send(
+            embed=helper.import_info(
+                guild, diff, parsed.timezone, parsed.category_mode
+            ),
+            ephemeral=True,
+        )
+
+    @config_set_sub_command_group.sub_command(name="window")
+    async def config_add_window(
+        self,
+        interaction: ApplicationCommandInteraction,
+        channel: TextChannel,
+        time_lock: str,
+        time_unlock: str,
+        days: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+    ) -> None:
+        """Add another window during which a channel is locked
+
+        Parameters
+        ----------
+        channel: The text channel to lock during the window
+        time_lock: When the window starts (24-hour time- 23:00)
+        time_unlock: When the window ends, the next day if earlier (24-hour time- 06:00)
+        days: Weekdays the window starts on, a range or list of weekday numbers
+        start_date: First date the window applies (YYYY-MM-DD)
+        end_date: Last date the window applies (YYYY-MM-DD)
+        """
+        guild = interaction.guild
+
+        try:
+            lock, unlock = helper.parse_time(time_lock), helper.parse_time(time_unlock)
+        except ValueError:
+            return await interaction.response.send_message(
+                "Please make sure the times are in the correct format:\n"
+                "Must be in 24-hour format and should  appear as hour:minutes. [examples: 03:30, 00:20, 20:15]",
+                ephemeral=True,
+            )
+
+        try:
+            days = helper.split_days(days) if days else None
+        except ValueError:
+            return await interaction.response.send_message(
+                "Invalid days format\nMust a range or list of weekday numbers\n`1-3` (Tuesday-Thursday) or `0, 2, 4, 6` (Monday, Wednesday, Friday, Sunday)",
+                ephemeral=True,
+            )
+
+        try:
+            start = helper.parse_date(start_date) if start_date else None
+            end = helper.parse_date(end_date) if end_date else None
+        except ValueError:
+            return await interaction.response.send_message(
+                "Dates must be in the format YYYY-MM-DD [example: 2022-12-24]",
+                ephemeral=True,
+            )
+
+        await cache.add_channel_schedule(
+            guild.id,
+            channel_id=channel.id,
+            time_lock=lock,
+            time_unlock=unlock,
+            days=days,
+            start_date=start,
+            end_date=end,
+        )
+        self.bot.scheduler.schedule_channel(channel.id)
+        self.names.add(guild.id, channel.id, channel.name)
+
+        await interaction.response.send_message(
+            "**Window Added!**\n\n"
+            f"**Channel**: {channel.name}\n"
+            f"**Lock Time**: {time_lock}\n"
+            f"**Unlock Time**: {time_unlock}\n"
+            f"**Days**: {days}\n"
+            f"**Dates**: {start or 'any'} - {end or 'any'}",
+            ephemeral=True,
+        )
+
+    @config_set_sub_command_group.sub_command(name="exception")
+    async def config_add_exception(
+        self,
+        interaction: ApplicationCommandInteraction,
+        channel: TextChannel,
+        start_date: str,
+        end_date: Optional[str] = None,
+    ) -> None:
+        """Suspend a channel's lock/unlock schedule on some dates, e.g. holidays
+
+        Parameters
+        ----------
+        channel: The text channel whose schedule is suspended
+        start_date: First date of the exception (YYYY-MM-DD)
+        end_date: Last date of the exception, defaults to the first (YYYY-MM-DD)
+        """
+        guild = interaction.guild
+
+        try:
+            start = helper.parse_date(start_date)
+            end = helper.parse_date(end_date) if end_date else start
+        except ValueError:
+            return await interaction.response.send_message(
+                "Dates must be in the format YYYY-MM-DD [example: 2022-12-24]",
+                ephemeral=True,
+            )
+
+        await cache.add_channel_schedule(
+            guild.id,
+            channel_id=channel.id,
+            start_date=start,
+            end_date=end,
+            exception=True,
+        )
+        self.bot.scheduler.schedule_channel(channel.id)
+        self.names.add(guild.id, channel.id, channel.name)
+
+        await interaction.response.send_message(
+            f"#{channel.name} will not be locked or unlocked from {start} to {end}",
+            ephemeral=True,
+        )
+
+    @config.sub_command(name="clear")
+    async def config_clear_windows(
+        self, interaction: ApplicationCommandInteraction, channel: TextChannel
+    ) -> None:
+        """Remove every extra window and exception from a channel
+
+        Parameters
+        ----------
+        channel: A discord text channel
+        """
+
+        removed = await cache.remove_channel_schedules(channel.id)
+        self.bot.scheduler.schedule_channel(channel.id)
+
+        await interaction.response.send_message(
+            f"Removed {removed} window(s) and exception(s) from #{channel.name}",
+            ephemeral=True,
+        )
+
     @config.sub_command(name="remove")
     async def config_remove_channel(
         self, interaction: ApplicationCommandInteraction, channel: str
@@ -181,22 +500,45 @@ class Config(Cog):
         """
 
         guild = interaction.guild
-        channel = utils.get(guild.text_channels, name=channel)
-        await query.remove_channel(channel.id)
+        config = await cache.get_guild_config(guild.id)
+
+        # the picker sends the channel ID, a typed name is looked up instead
+        if channel.isdigit() and int(channel) in config.channels:
+            channel_ids = [int(channel)]
+        else:
+            self._index_guild(guild)
+            channel_ids = self.names.find(guild.id, channel)
+
+        if not channel_ids:
+            return await interaction.response.send_message(
+                f"{channel} is not a configured channel", ephemeral=True
+            )
+
+        if len(channel_ids) > 1:
+            return await interaction.response.send_message(
+                f"More than one channel is named {channel}, pick one from the list",
+                ephemeral=True,
+            )
+
+        channel_id = channel_ids[0]
+        await cache.remove_channel(channel_id)
+        self.bot.scheduler.remove_channel(channel_id)
+        self.names.discard(guild.id, channel_id)
 
+        name = getattr(guild.get_channel(channel_id), "name", channel_id)
         await interaction.response.send_message(
-            f"#{channel.name} has been removed", ephemeral=True
+            f"#{name} has been removed", ephemeral=True
         )
 
     @config_remove_channel.autocomplete("channel")
     async def channel_auto_complete(
         self, interaction: ApplicationCommandInteraction, string: str
-    ) -> list:
-        """Auto complete channels to select from with the remove channel command"""
+    ) -> dict[str, str]:
+        """Auto complete channels to select from with the remove channel command
+        Answered from the in-memory name index, without any database I/O"""
 
-        string = string.lower()
         guild = interaction.guild
-        channel_ids = await query.get_channel_ids(guild.id)
-        channels = [guild.get_channel(i) for i in channel_ids]
+        if not self._index_guild(guild):
+            return {}
 
-        return [c.name for c in channels if string in c.name.lower()]
+        return self.names.search(guild.id, string)
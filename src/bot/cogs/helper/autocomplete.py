@@ -0,0 +1,116 @@
+"""In-memory name index of every guild's configured channels for autocomplete
+
+Autocomplete fires on every keystroke and must answer within Discord's 3 second
+deadline, so names are looked up in a per-guild sorted list of lowercase names
+instead of resolving the configured channel IDs from the database each time.
+"""
+
+import bisect
+from typing import Iterable
+
+from bot.scheduler.planner import LOCKED, UNLOCKED
+
+# Discord rejects autocomplete responses with more choices than this
+MAX_CHOICES = 25
+
+
+def _key(name: str) -> str:
+    """Lowercase name without the lock/unlock markers, what users type"""
+    return name.replace(LOCKED, "").replace(UNLOCKED, "").lower()
+
+
+class ChannelNameIndex:
+    """Sorted lowercase names of the configured channels of each guild
+
+    The index is built per guild on first use and kept in sync by the Config cog
+    when channels are configured, removed, renamed or deleted."""
+
+    def __init__(self) -> None:
+        # guild_id -> sorted [(name key, channel_id)]
+        self._sorted: dict[int, list[tuple[str, int]]] = {}
+        # guild_id -> channel_id -> display name
+        self._names: dict[int, dict[int, str]] = {}
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._names
+
+    def build(self, guild_id: int, channels: Iterable[tuple[int, str]]) -> None:
+        """Replace the guild's index with the given (channel_id, name) pairs"""
+        names = self._names[guild_id] = dict(channels)
+        self._sorted[guild_id] = sorted((_key(n), i) for i, n in names.items())
+
+    def add(self, guild_id: int, channel_id: int, name: str) -> None:
+        """Index a channel, or update its name, in a guild that is indexed"""
+        if guild_id not in self._names:
+            # built with the current names on the next lookup
+            return
+
+        self.discard(guild_id, channel_id)
+        self._names[guild_id][channel_id] = name
+        bisect.insort(self._sorted[guild_id], (_key(name), channel_id))
+
+    def discard(self, guild_id: int, channel_id: int) -> None:
+        """Drop a channel from the guild's index if it is indexed"""
+        name = self._names.get(guild_id, {}).pop(channel_id, None)
+        if name is None:
+            return
+
+        entries = self._sorted[guild_id]
+        entry = (_key(name), channel_id)
+        i = bisect.bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    def forget(self, guild_id: int) -> None:
+        """Drop the guild's index entirely"""
+        self._names.pop(guild_id, None)
+        self._sorted.pop(guild_id, None)
+
+    def find(self, guild_id: int, name: str) -> list[int]:
+        """Returns the IDs of the guild's channels named exactly `name`, ignoring
+        case and the lock/unlock markers"""
+        entries = self._sorted.get(guild_id, [])
+        name = _key(name)
+
+        i = bisect.bisect_left(entries, (name,))
+        ids = []
+        while i < len(entries) and entries[i][0] == name:
+            ids.append(entries[i][1])
+            i += 1
+        return ids
+
+    def search(
+        self, guild_id: int, text: str, limit: int = MAX_CHOICES
+    ) -> dict[str, str]:
+        """Returns up to `limit` channels matching the text as {name: channel ID}
+        Names starting with the text come first, then names containing it"""
+
+        entries = self._sorted.get(guild_id, [])
+        names = self._names.get(guild_id, {})
+        text = _key(text)
+
+        matches = []
+        i = bisect.bisect_left(entries, (text,))
+        while i < len(entries) and len(matches) < limit:
+            key, channel_id = entries[i]
+            if not key.startswith(text):
+                break
+            matches.append(channel_id)
+            i += 1
+
+        if len(matches) < limit and text:
+            prefixed = set(matches)
+            for key, channel_id in entries:
+                if text in key and channel_id not in prefixed:
+                    matches.append(channel_id)
+                    if len(matches) == limit:
+                        break
+
+        choices = {}
+        for channel_id in matches:
+            name = names[channel_id]
+            if name in choices:
+                # choice names must be unique, tell same-named channels apart
+                name = f"{name} ({channel_id})"
+            choices[name] = str(channel_id)
+        return choices
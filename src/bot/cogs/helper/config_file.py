@@ -0,0 +1,298 @@
+"""Export a guild's channel config to JSON or CSV and parse it back for import
+
+An imported file describes the complete lock/unlock config of every channel it
+lists, a blank time or days clears it. Files are validated as a whole so a bad
+row never leaves a guild half imported.
+
+Only JSON holds the guild's category mode and the channels' extra lock windows
+and exceptions. A channel imported without a "windows" list, as from CSV, keeps
+the windows it has.
+"""
+
+import csv
+import io
+import json
+from datetime import date, time
+from typing import NamedTuple, Optional
+
+import pytz
+from disnake import Guild, TextChannel, utils
+
+from bot.cogs.helper import helper
+from bot.config.cache import GuildConfig
+
+FORMATS = ("json", "csv")
+FIELDS = ("channel_id", "channel", "time_lock", "time_unlock", "days")
+
+# limits on what an import may contain
+MAX_BYTES = 1024 * 1024
+MAX_CHANNELS = 5000
+
+
+class ConfigFileError(ValueError):
+    """Raised when an import file is not valid, with one message per problem"""
+
+    def __init__(self, errors: list[str]) -> None:
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+class ChannelRow(NamedTuple):
+    """One validated channel of an import file"""
+
+    channel_id: int
+    time_lock: Optional[time]
+    time_unlock: Optional[time]
+    days: Optional[str]
+
+
+class WindowRow(NamedTuple):
+    """One validated lock window or exception of a channel"""
+
+    time_lock: Optional[time]
+    time_unlock: Optional[time]
+    days: Optional[str]
+    start_date: Optional[date]
+    end_date: Optional[date]
+    exception: bool
+
+
+class ConfigFile(NamedTuple):
+    """A validated import file, timezone and category_mode are None when the file
+    does not set them, `windows` only lists the channels whose windows it sets"""
+
+    timezone: Optional[str]
+    channels: list[ChannelRow]
+    category_mode: Optional[bool]
+    windows: dict[int, list[WindowRow]]
+
+
+def _clock(value: Optional[time]) -> Optional[str]:
+    return None if value is None else value.strftime("%H:%M")
+
+
+def _day(value: Optional[date]) -> Optional[str]:
+    return None if value is None else value.isoformat()
+
+
+def _records(guild: Guild, config: GuildConfig) -> list[dict]:
+    """Returns one export record per configured channel, with its windows"""
+    records = []
+    for c in config.channels.values():
+        channel = guild.get_channel(c.channel_id)
+        records.append(
+            {
+                "channel_id": c.channel_id,
+                "channel": channel.name if channel else None,
+                "time_lock": _clock(c.time_lock),
+                "time_unlock": _clock(c.time_unlock),
+                "days": c.days,
+                "windows": [
+                    {
+                        "time_lock": _clock(w.time_lock),
+                        "time_unlock": _clock(w.time_unlock),
+                        "days": w.days,
+                        "start_date": _day(w.start_date),
+                        "end_date": _day(w.end_date),
+                        "exception": w.exception,
+                    }
+                    for w in c.windows
+                ],
+            }
+        )
+    return records
+
+
+def export(guild: Guild, config: GuildConfig, fmt: str) -> bytes:
+    """Serialize the guild's config, CSV only holds the channels' own times"""
+
+    records = _records(guild, config)
+
+    if fmt == "json":
+        document = {
+            "guild": guild.id,
+            "timezone": config.timezone,
+            "category_mode": config.category_mode,
+            "channels": records,
+        }
+        return json.dumps(document, indent=2, ensure_ascii=False).encode()
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(records)
+    return buffer.getvalue().encode()
+
+
+def _text(value) -> Optional[str]:
+    """Blank values, from either format, become None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _row(
+    guild: Guild, record: dict, where: str, errors: list[str]
+) -> Optional[ChannelRow]:
+    """Validate one channel record, appending any problem to `errors`"""
+
+    channel_id = _text(record.get("channel_id"))
+    name = _text(record.get("channel"))
+
+    channel: Optional[TextChannel] = None
+    if channel_id is not None:
+        if channel_id.isdigit():
+            channel = guild.get_channel(int(channel_id))
+    elif name is not None:
+        channel = utils.get(guild.text_channels, name=name.lstrip("#"))
+
+    if not isinstance(channel, TextChannel):
+        errors.append(f"{where}: no text channel {channel_id or name or '(blank)'}")
+        return None
+
+    times = []
+    for key in ("time_lock", "time_unlock"):
+        value = _text(record.get(key))
+        try:
+            times.append(None if value is None else helper.parse_time(value))
+        except ValueError:
+            errors.append(
+                f"{where}: {key} {value!r} is not a 24-hour hour:minutes time"
+            )
+
+    days = _text(record.get("days"))
+    try:
+        days = None if days is None else helper.split_days(days)
+    except ValueError:
+        errors.append(f"{where}: days {days!r} is not a range or list of weekdays")
+
+    if len(times) != 2:
+        return None
+
+    return ChannelRow(channel.id, times[0], times[1], days)
+
+
+def _window(record: dict, where: str, errors: list[str]) -> Optional[WindowRow]:
+    """Validate one window or exception of a channel record"""
+
+    if not isinstance(record, dict):
+        errors.append(f"{where}: not an object")
+        return None
+
+    count = len(errors)
+    exception = record.get("exception", False)
+    if not isinstance(exception, bool):
+        errors.append(f"{where}: exception must be true or false")
+
+    values = {}
+    for key, parser in (
+        ("time_lock", helper.parse_time),
+        ("time_unlock", helper.parse_time),
+        ("start_date", helper.parse_date),
+        ("end_date", helper.parse_date),
+    ):
+        value = _text(record.get(key))
+        try:
+            values[key] = None if value is None else parser(value)
+        except ValueError:
+            errors.append(f"{where}: {key} {value!r} is not valid")
+
+    days = _text(record.get("days"))
+    try:
+        days = None if days is None else helper.split_days(days)
+    except ValueError:
+        errors.append(f"{where}: days {days!r} is not a range or list of weekdays")
+
+    if len(errors) > count:
+        return None
+
+    if exception:
+        if values["start_date"] is None:
+            errors.append(f"{where}: an exception needs a start_date")
+            return None
+        # like /config set exception, a single day when the end is left out
+        values["end_date"] = values["end_date"] or values["start_date"]
+    elif values["time_lock"] is None or values["time_unlock"] is None:
+        errors.append(f"{where}: a window needs a time_lock and time_unlock")
+        return None
+
+    return WindowRow(
+        values["time_lock"],
+        values["time_unlock"],
+        days,
+        values["start_date"],
+        values["end_date"],
+        exception,
+    )
+
+
+def parse(guild: Guild, filename: str, data: bytes) -> ConfigFile:
+    """Parse and validate an exported JSON or CSV file against the guild
+    Raises ConfigFileError listing every problem found"""
+
+    if len(data) > MAX_BYTES:
+        raise ConfigFileError([f"File is larger than {MAX_BYTES // 1024}KB"])
+
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ConfigFileError(["File is not UTF-8 text"])
+
+    timezone = category_mode = None
+    if filename.lower().endswith(".csv"):
+        records = list(csv.DictReader(io.StringIO(text)))
+    else:
+        try:
+            document = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ConfigFileError([f"File is not valid JSON: {e}"])
+
+        if not isinstance(document, dict) or not isinstance(
+            document.get("channels", []), list
+        ):
+            raise ConfigFileError(['JSON must be an object with a "channels" list'])
+
+        timezone = _text(document.get("timezone"))
+        category_mode = document.get("category_mode")
+        records = document.get("channels", [])
+
+    errors = []
+    if timezone is not None and timezone not in pytz.all_timezones:
+        errors.append(f"timezone {timezone!r} is not a supported timezone")
+    if category_mode is not None and not isinstance(category_mode, bool):
+        errors.append("category_mode must be true or false")
+
+    if len(records) > MAX_CHANNELS:
+        errors.append(f"File lists more than {MAX_CHANNELS} channels")
+        records = []
+
+    rows: dict[int, ChannelRow] = {}
+    windows: dict[int, list[WindowRow]] = {}
+    for i, record in enumerate(records, start=1):
+        where = f"row {i}"
+        if not isinstance(record, dict):
+            errors.append(f"{where}: not an object")
+            continue
+
+        row = _row(guild, record, where, errors)
+        if row is None:
+            continue
+
+        if row.channel_id in rows:
+            errors.append(f"{where}: channel {row.channel_id} is listed twice")
+        rows[row.channel_id] = row
+
+        if record.get("windows") is not None:
+            if not isinstance(record["windows"], list):
+                errors.append(f"{where}: windows must be a list")
+                continue
+            windows[row.channel_id] = [
+                _window(w, f"{where} window {j}", errors)
+                for j, w in enumerate(record["windows"], start=1)
+            ]
+
+    if errors:
+        raise ConfigFileError(errors)
+
+    return ConfigFile(timezone, list(rows.values()), category_mode, windows)
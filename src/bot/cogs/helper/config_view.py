@@ -0,0 +1,136 @@
+"""Memoized rendering of /config view
+
+Tabulating every channel of a large guild on each /config view is wasted work
+while its config does not change, so the rendered table is kept per guild along
+with the config version and guild name it was rendered from. A table longer than
+an embed field is split into pages as they are looked at.
+"""
+
+from typing import Hashable, Iterator, Optional
+
+from bot.cogs.helper import helper
+from bot.config.cache import GuildConfig
+from disnake import ButtonStyle, Embed, Guild, MessageInteraction
+from disnake.ui import Button, View, button
+
+# Discord rejects embed field values longer than this
+FIELD_LIMIT = 1024
+# room for the table inside the field's code block
+PAGE_CHARS = FIELD_LIMIT - len("```py\n```")
+# table lines repeated at the top of every page
+HEADER_LINES = 2
+
+
+def _stamp(guild: Guild, config: GuildConfig) -> Hashable:
+    """What a rendered view depends on besides the channels' names"""
+    return config.version, guild.name, guild.icon and guild.icon.key
+
+
+class ConfigPages:
+    """The rendered config view of one guild, split into pages on demand"""
+
+    def __init__(self, guild: Guild, config: GuildConfig) -> None:
+        self.stamp = _stamp(guild, config)
+        self._guild = guild
+        self._config = config
+
+        table = helper.format_channels(guild, list(config.channels.values()))
+        self._lines = table.splitlines() if table else []
+        self._tables: list[str] = []
+        self._pending: Optional[Iterator[str]] = self._paginate()
+        self._embeds: dict[int, Embed] = {}
+
+    def _paginate(self) -> Iterator[str]:
+        """Yields the table in pieces that fit an embed field, whole lines each"""
+
+        header = self._lines[:HEADER_LINES]
+        room = PAGE_CHARS - sum(len(line) + 1 for line in header)
+
+        page, size = [], 0
+        for line in self._lines[HEADER_LINES:]:
+            if page and size + len(line) + 1 > room:
+                yield "\n".join(header + page)
+                page, size = [], 0
+            page.append(line)
+            size += len(line) + 1
+
+        if page:
+            yield "\n".join(header + page)
+
+    def has(self, index: int) -> bool:
+        """True if the page exists, paginating only as far as needed"""
+
+        while self._pending is not None and len(self._tables) <= index:
+            table = next(self._pending, None)
+            if table is None:
+                self._pending = None
+            else:
+                self._tables.append(table)
+
+        return 0 <= index < len(self._tables)
+
+    def embed(self, index: int = 0) -> Embed:
+        """Returns the embed showing the page, built the first time it is asked for"""
+
+        embed = self._embeds.get(index)
+        if embed is not None:
+            return embed
+
+        table = self._tables[index] if self.has(index) else None
+        embed = helper.guild_config_info(self._guild, self._config, table)
+
+        if self.has(1):
+            embed.set_footer(text=f"Page {index + 1}")
+
+        self._embeds[index] = embed
+        return embed
+
+
+class ConfigViews:
+    """Rendered config views per guild, re-rendered when the guild's config
+    version changes or its configured channels are renamed"""
+
+    def __init__(self) -> None:
+        self._rendered: dict[int, ConfigPages] = {}
+
+    def get(self, guild: Guild, config: GuildConfig) -> ConfigPages:
+        """Returns the guild's rendered view, rendering it if it is stale"""
+
+        rendered = self._rendered.get(guild.id)
+        if rendered is None or rendered.stamp != _stamp(guild, config):
+            rendered = self._rendered[guild.id] = ConfigPages(guild, config)
+        return rendered
+
+    def discard(self, guild_id: int) -> None:
+        """Forget the guild's rendered view"""
+        self._rendered.pop(guild_id, None)
+
+
+class PageView(View):
+    """Previous and next buttons for a config view with more than one page"""
+
+    def __init__(self, pages: ConfigPages) -> None:
+        super().__init__(timeout=300)
+        self.pages = pages
+        self.index = 0
+        self._update()
+
+    def _update(self) -> None:
+        self.previous.disabled = self.index == 0
+        self.next.disabled = not self.pages.has(self.index + 1)
+
+    async def _show(self, interaction: MessageInteraction) -> None:
+        self._update()
+        await interaction.response.edit_message(
+            embed=self.pages.embed(self.index), view=self
+        )
+
+    @button(label="Previous", style=ButtonStyle.secondary)
+    async def previous(self, _: Button, interaction: MessageInteraction) -> None:
+        self.index = max(0, self.index - 1)
+        await self._show(interaction)
+
+    @button(label="Next", style=ButtonStyle.secondary)
+    async def next(self, _: Button, interaction: MessageInteraction) -> None:
+        self.index += 1
+        await self._show(interaction)
@@ -1,53 +1,77 @@
 """A module of helper functions"""
 
-from datetime import datetime
-from typing import NewType
+from datetime import date, time
+from typing import NewType, Optional
 
-from bot.config import model
+from bot import metrics
+from bot.config import cache, model
+from bot.config.cache import ChannelConfig, GuildConfig, ScheduleWindow
 from disnake import Color, Embed, Guild, TextChannel
 from tabulate import tabulate
 
 Table = NewType("Table[tabulate]", str)
 
 
-def split_days(days: str) -> list[str]:
-    """Split the days into a list of days"""
+def split_days(days: str) -> str:
+    """Validate the days and return them as a list or range of weekday numbers
+    Raises ValueError if the days are not valid"""
 
-    if "-" in days:
-        days = days.split("-")
-        sep = "-"
+    days = days.replace(" ", "")
+    model.days_mask(days)
+    return days
 
-    if "," in days:
-        days = days.split(",")
-        sep = ","
 
-    check = [int(d) for d in days]
-    if all([c < 7 and c > -1 for c in check]):
-        # all can be converted to int and within the 0-6 range
-        return f"{sep}".join(days)
+def parse_time(value: str) -> time:
+    """Parse a 24-hour hour:minutes time, raises ValueError if it is not valid"""
+    hours, minutes = value.split(":")
+    return time(int(hours), int(minutes))
 
-    raise ValueError
 
+def parse_date(value: str) -> date:
+    """Parse a YYYY-MM-DD date, raises ValueError if it is not valid"""
+    return date.fromisoformat(value.strip())
 
-def format_channels(guild: Guild, channels: model.Channel) -> Table:
+
+def _dates(window: ScheduleWindow) -> str:
+    """Formats a window's date range, open ends are left blank"""
+    start = window.start_date.isoformat() if window.start_date else ""
+    end = window.end_date.isoformat() if window.end_date else ""
+    return f"{start}..{end}"
+
+
+def _clock(seconds: Optional[int]) -> str:
+    """Formats seconds since midnight as HH:MM"""
+    if seconds is None:
+        return "None"
+    return f"{seconds // 3600:02}:{seconds // 60 % 60:02}"
+
+
+def format_channels(guild: Guild, channels: list[ChannelConfig]) -> Table:
     """Formats the channels into a table ready for a Discord embed"""
-    if channels == []:
+    if not channels:
         return
 
     table = []
     for c in channels:
         channel: TextChannel = guild.get_channel(c.channel_id)
-        name = f"#{channel.name}"
-        time_lock: str = (
-            "None" if c.time_lock is None else c.time_lock.strftime("%H:%M")
-        )
-        time_unlock: str = (
-            "None" if c.time_unlock is None else c.time_unlock.strftime("%H:%M")
-        )
+        # deleted while the bot was offline, mentions do not render in the table
+        name = f"#{channel.name}" if channel else str(c.channel_id)
+        time_lock: str = _clock(c.lock)
+        time_unlock: str = _clock(c.unlock)
         days = "None" if c.days is None else c.days
 
         table.append([name, time_lock, time_unlock, days])
 
+        for w in c.windows:
+            if w.exception:
+                table.append(["  skip", "-", "-", _dates(w)])
+                continue
+
+            days = "None" if w.days is None else w.days
+            if w.start_date or w.end_date:
+                days = f"{days} {_dates(w)}"
+            table.append(["  window", _clock(w.lock), _clock(w.unlock), days])
+
     return tabulate(
         table,
         headers=["\u200b", "Lock Time", "Unlock Time", "Days"],
@@ -56,12 +80,21 @@ def format_channels(guild: Guild, channels: model.Channel) -> Table:
     )
 
 
-def guild_config_info(slash_guild: Guild, guild: model.Guild) -> Embed:
-    """Create and return the embed for guild config view"""
+def config_color(guild_id: int) -> Color:
+    """A colour of its own for each guild that stays the same between views"""
+    return Color.from_hsv(guild_id % 360 / 360, 0.6, 0.9)
+
 
-    channels = format_channels(slash_guild, guild.channels)
+def guild_config_info(
+    slash_guild: Guild, guild: GuildConfig, channels: Optional[str] = None
+) -> Embed:
+    """Create and return the embed for guild config view
+    `channels` is the formatted channels table, or one page of it"""
 
-    embed = Embed(title=f"Current Config for {slash_guild.name}", color=Color.random())
+    embed = Embed(
+        title=f"Current Config for {slash_guild.name}",
+        color=config_color(slash_guild.id),
+    )
     if slash_guild.icon:
         embed.set_thumbnail(url=slash_guild.icon.url)
     embed.add_field(
@@ -71,6 +104,11 @@ def guild_config_info(slash_guild: Guild, guild: model.Guild) -> Embed:
         else "No timezone configured (default: UTC)",
         inline=False,
     )
+    embed.add_field(
+        name="Category mode",
+        value="Enabled" if guild.category_mode else "Disabled",
+        inline=False,
+    )
     if channels is None:
         embed.add_field(name="Channels:", value="No channels configured", inline=False)
     else:
@@ -79,19 +117,113 @@ def guild_config_info(slash_guild: Guild, guild: model.Guild) -> Embed:
     return embed
 
 
-def combine_date_time(date: datetime.date, time: datetime.time, timezone) -> datetime:
-    """combine datetime and stored time objects as tz aware datetime object"""
-    return datetime.combine(date, time).astimezone(timezone)
+def import_info(
+    guild: Guild,
+    diff: dict[str, list[int]],
+    timezone: Optional[str],
+    category_mode: Optional[bool] = None,
+) -> Embed:
+    """Create and return the embed reporting what an import changed"""
+
+    embed = Embed(title="Config imported", color=Color.green())
+    if timezone is not None:
+        embed.add_field(name="Timezone", value=timezone, inline=False)
+    if category_mode is not None:
+        embed.add_field(
+            name="Category Mode",
+            value="Enabled" if category_mode else "Disabled",
+            inline=False,
+        )
+
+    for key in ("added", "changed", "removed", "unchanged"):
+        channel_ids = diff[key]
+        if not channel_ids:
+            continue
+
+        names = []
+        for channel_id in channel_ids[:30]:
+            channel = guild.get_channel(channel_id)
+            names.append(f"#{channel.name}" if channel else str(channel_id))
+        if len(channel_ids) > 30:
+            names.append(f"...and {len(channel_ids) - 30} more")
+
+        embed.add_field(
+            name=f"{key.capitalize()} ({len(channel_ids)})",
+            value=", ".join(names)[:1024],
+            inline=False,
+        )
+
+    return embed
+
 
+def _seconds(value: Optional[float]) -> str:
+    """Format a duration for the stats embed"""
+    if value is None:
+        return "-"
+    if value == float("inf"):
+        return "> 60s"
+    return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.1f}s"
 
-def should_run(days: str, weekday: int) -> bool:
-    """Returns true if weekday is in the range of days"""
-    if "," in days:
-        days = days.split(",")
-        days = [int(d) for d in days]
-        return weekday in days
 
-    if "-" in days:
-        days = days.split("-")
-        start, end = [int(d) for d in days]
-        return weekday in range(start, end)
+def stats_info(scheduled: int) -> Embed:
+    """Create and return the embed for the scheduler/query stats view"""
+
+    embed = Embed(title="ChannelStatus stats", color=Color.blurple())
+
+    ticks = metrics.TICK_SECONDS
+    channels = metrics.CHANNELS
+    embed.add_field(
+        name="Scheduler",
+        value=(
+            f"Scheduled channels: {scheduled}\n"
+            f"Ticks: {ticks.count()} (mean {_seconds(ticks.mean())}, p99 {_seconds(ticks.quantile(0.99))})\n"
+            + ", ".join(
+                f"{result}: {int(channels.get(result=result))}"
+                for result in (
+                    "evaluated",
+                    "locked",
+                    "unlocked",
+                    "skipped",
+                    "missing",
+                    "failed",
+                )
+            )
+        ),
+        inline=False,
+    )
+
+    lateness = metrics.ACTION_LATENESS
+    actions = metrics.ACTION_SECONDS
+    embed.add_field(
+        name="Actions",
+        value=(
+            f"Lateness p50 {_seconds(lateness.quantile(0.5))}, p99 {_seconds(lateness.quantile(0.99))}\n"
+            f"Duration p50 {_seconds(actions.quantile(0.5))}, p99 {_seconds(actions.quantile(0.99))}\n"
+            + ", ".join(
+                f"{route}: {int(calls)} calls / {int(metrics.DISCORD_ERRORS.get(route=route))} errors"
+                for (route,), calls in metrics.DISCORD_CALLS.values.items()
+            )
+        ),
+        inline=False,
+    )
+
+    queries = metrics.QUERY_SECONDS
+    table = [
+        [name, series.count, _seconds(series.sum / series.count)]
+        for (name,), series in sorted(queries.series.items())
+    ]
+    embed.add_field(
+        name="Queries",
+        value=f"```py\n{tabulate(table, headers=['Query', 'Calls', 'Mean'])}```"
+        if table
+        else "No queries yet",
+        inline=False,
+    )
+
+    embed.add_field(
+        name="Config cache",
+        value=f"{cache.stats['hits']} hits, {cache.stats['misses']} misses",
+        inline=False,
+    )
+
+    return embed
@@ -0,0 +1,611 @@
+"""Process-wide in-memory cache of the guild/channel config
+
+Reads are served from memory, writes go through `bot.config.query` first and are
+then applied to the cached records so the cache never runs ahead of the database.
+"""
+
+import itertools
+import sys
+from dataclasses import dataclass, field
+from datetime import date, time
+from typing import AsyncIterator, Iterable, Iterator, Optional
+
+from bot import metrics
+from bot.config import model, query
+
+# hit/miss counters for reads served by this module
+stats = {"hits": 0, "misses": 0}
+
+metrics.Gauge(
+    "channelstatus_config_cache_hits",
+    "Config reads served from memory",
+    lambda: stats["hits"],
+)
+metrics.Gauge(
+    "channelstatus_config_cache_misses",
+    "Config reads that fell back to the database",
+    lambda: stats["misses"],
+)
+
+
+def _seconds(t: Optional[time]) -> Optional[int]:
+    """Seconds since midnight of a stored time, None stays None"""
+    return None if t is None else t.hour * 3600 + t.minute * 60 + t.second
+
+
+def _time(seconds: Optional[int]) -> Optional[time]:
+    """Inverse of `_seconds`"""
+    return (
+        None
+        if seconds is None
+        else time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+    )
+
+
+class ScheduleWindow:
+    """Compact cached copy of a channel_schedule row, a lock window or exception
+    Times are kept as seconds since local midnight like `ChannelConfig`"""
+
+    __slots__ = (
+        "id",
+        "lock",
+        "unlock",
+        "days",
+        "days_mask",
+        "start_date",
+        "end_date",
+        "exception",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        time_lock: Optional[time] = None,
+        time_unlock: Optional[time] = None,
+        days: Optional[str] = None,
+        days_mask: int = model.ALL_DAYS,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        exception: bool = False,
+    ) -> None:
+        self.id = id
+        self.lock: Optional[int] = _seconds(time_lock)
+        self.unlock: Optional[int] = _seconds(time_unlock)
+        self.days = None if days is None else sys.intern(days)
+        self.days_mask = days_mask
+        self.start_date = start_date
+        self.end_date = end_date
+        self.exception = exception
+
+    @property
+    def time_lock(self) -> Optional[time]:
+        return _time(self.lock)
+
+    @property
+    def time_unlock(self) -> Optional[time]:
+        return _time(self.unlock)
+
+    @classmethod
+    def from_row(cls, row: model.ChannelSchedule) -> "ScheduleWindow":
+        return cls(
+            row.id,
+            row.time_lock,
+            row.time_unlock,
+            row.days,
+            row.days_mask,
+            row.start_date,
+            row.end_date,
+            row.exception,
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ScheduleWindow):
+            return NotImplemented
+        return all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{a}={getattr(self, a)!r}" for a in self.__slots__)
+        return f"ScheduleWindow({fields})"
+
+
+class ChannelConfig:
+    """Compact cached copy of a channel row
+
+    Lock and unlock times are kept as seconds since local midnight, which is what
+    the scheduler works with, `time_lock`/`time_unlock` convert on access."""
+
+    __slots__ = (
+        "guild",
+        "channel_id",
+        "lock",
+        "unlock",
+        "unlocked",
+        "days",
+        "days_mask",
+        "windows",
+    )
+
+    def __init__(
+        self,
+        guild: int,
+        channel_id: int,
+        time_lock: Optional[time] = None,
+        time_unlock: Optional[time] = None,
+        unlocked: bool = True,
+        days: Optional[str] = None,
+        days_mask: int = model.ALL_DAYS,
+        windows: tuple[ScheduleWindow, ...] = (),
+    ) -> None:
+        self.guild = guild
+        self.channel_id = channel_id
+        self.lock: Optional[int] = _seconds(time_lock)
+        self.unlock: Optional[int] = _seconds(time_unlock)
+        self.unlocked = unlocked
+        # the same few days strings repeat across every guild
+        self.days = None if days is None else sys.intern(days)
+        self.days_mask = days_mask
+        # extra lock windows and exceptions, replaced as a whole on change
+        self.windows = windows
+
+    @property
+    def time_lock(self) -> Optional[time]:
+        return _time(self.lock)
+
+    @time_lock.setter
+    def time_lock(self, value: Optional[time]) -> None:
+        self.lock = _seconds(value)
+
+    @property
+    def time_unlock(self) -> Optional[time]:
+        return _time(self.unlock)
+
+    @time_unlock.setter
+    def time_unlock(self, value: Optional[time]) -> None:
+        self.unlock = _seconds(value)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ChannelConfig):
+            return NotImplemented
+        return all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{a}={getattr(self, a)!r}" for a in self.__slots__)
+        return f"ChannelConfig({fields})"
+
+
+# config versions, never reused so a reloaded guild never matches an old stamp
+_versions = itertools.count(1)
+
+
+@dataclass
+class GuildConfig:
+    """Cached copy of a guild row and its channels, keyed by channel ID
+    `version` changes on every config write, for caches of derived data"""
+
+    id: int
+    timezone: Optional[str] = None
+    category_mode: bool = False
+    channels: dict[int, ChannelConfig] = field(default_factory=dict)
+    version: int = field(default_factory=lambda: next(_versions), compare=False)
+
+
+def _touch(guild: GuildConfig) -> None:
+    """Stamp the guild with a new version after its config changed"""
+    guild.version = next(_versions)
+
+
+_guilds: dict[int, GuildConfig] = {}
+_channels: dict[int, ChannelConfig] = {}
+# channel_id -> unlocked, written behind by flush_channel_statuses
+_pending_statuses: dict[int, bool] = {}
+
+
+def _group_windows(
+    rows: Iterable[model.ChannelSchedule],
+) -> dict[int, tuple[ScheduleWindow, ...]]:
+    """Group channel_schedule rows into cached windows by channel ID"""
+    windows: dict[int, list[ScheduleWindow]] = {}
+    for row in rows:
+        windows.setdefault(row.channel_id, []).append(ScheduleWindow.from_row(row))
+    return {channel_id: tuple(w) for channel_id, w in windows.items()}
+
+
+def _window_key(window: ScheduleWindow) -> tuple:
+    """A window as the tuple `import_channels` takes"""
+    return (
+        window.time_lock,
+        window.time_unlock,
+        window.days,
+        window.start_date,
+        window.end_date,
+        window.exception,
+    )
+
+
+def _store(guild, windows: dict[int, tuple[ScheduleWindow, ...]]) -> GuildConfig:
+    """Convert a `model.Guild` row (with channels loaded) and its channels' windows
+    into cached records"""
+
+    config = GuildConfig(
+        id=guild.id, timezone=guild.timezone, category_mode=guild.category_mode
+    )
+    for c in guild.channels:
+        config.channels[c.channel_id] = ChannelConfig(
+            guild=guild.id,
+            channel_id=c.channel_id,
+            time_lock=c.time_lock,
+            time_unlock=c.time_unlock,
+            unlocked=c.unlocked,
+            days=c.days,
+            days_mask=c.days_mask,
+            windows=windows.get(c.channel_id, ()),
+        )
+
+    old = _guilds.pop(guild.id, None)
+    if old is not None:
+        for channel_id in old.channels:
+            _channels.pop(channel_id, None)
+
+    _guilds[guild.id] = config
+    _channels.update(config.channels)
+    return config
+
+
+async def stream_load(
+    shard_ids: Optional[Iterable[int]] = None,
+    shard_count: Optional[int] = None,
+    *,
+    chunk_size: int = 1000,
+) -> AsyncIterator[list[ChannelConfig]]:
+    """Load every guild and channel from the database, replacing the cache
+    Rows are streamed in chunks, the channels cached from each chunk are yielded
+    so callers can start using them before the whole table is read.
+    Only the guilds of the given shards are loaded when both are given"""
+
+    _guilds.clear()
+    _channels.clear()
+
+    # windows are rare, load them up front and attach them as channels stream in
+    windows = _group_windows(await query.get_channel_schedules(shard_ids, shard_count))
+
+    async for rows in query.stream_channel_schedules(
+        shard_ids, shard_count, chunk_size=chunk_size
+    ):
+        loaded = []
+        for guild_id, timezone, category_mode, channel_id, *schedule in rows:
+            guild = _guilds.get(guild_id)
+            if guild is None:
+                guild = _guilds[guild_id] = GuildConfig(
+                    id=guild_id, timezone=timezone, category_mode=category_mode
+                )
+
+            if channel_id is None:
+                continue
+
+            time_lock, time_unlock, unlocked, days, mask = schedule
+            channel = ChannelConfig(
+                guild=guild_id,
+                channel_id=channel_id,
+                time_lock=time_lock,
+                time_unlock=time_unlock,
+                unlocked=unlocked,
+                days=days,
+                days_mask=mask,
+                windows=windows.get(channel_id, ()),
+            )
+            guild.channels[channel_id] = _channels[channel_id] = channel
+            loaded.append(channel)
+
+        yield loaded
+
+
+async def load(
+    shard_ids: Optional[Iterable[int]] = None, shard_count: Optional[int] = None
+) -> None:
+    """Load every guild and channel from the database, replacing the cache
+    Only the guilds of the given shards are loaded when both are given"""
+
+    async for _ in stream_load(shard_ids, shard_count):
+        pass
+
+
+def guilds() -> Iterator[GuildConfig]:
+    """Iterate over every cached guild"""
+    return iter(list(_guilds.values()))
+
+
+def get_guild(guild_id: int) -> Optional[GuildConfig]:
+    """Return the cached guild without falling back to the database"""
+    return _guilds.get(guild_id)
+
+
+def get_channel(channel_id: int) -> Optional[ChannelConfig]:
+    """Return the cached channel, or None if it is not configured"""
+    return _channels.get(channel_id)
+
+
+async def get_guild_config(guild_id: int) -> GuildConfig:
+    """Returns the cached guild, loading (or creating) it on a miss"""
+
+    guild = _guilds.get(guild_id)
+    if guild is not None:
+        stats["hits"] += 1
+        return guild
+
+    stats["misses"] += 1
+    row = await query.get_guild_config(guild_id)
+
+    if row is None:
+        await query.add_guild(guild_id)
+        guild = _guilds[guild_id] = GuildConfig(id=guild_id)
+        return guild
+
+    windows = await query.get_channel_schedules(guild_id=guild_id)
+    return _store(row, _group_windows(windows))
+
+
+async def update_guild_timezone(guild_id: int, timezone: str) -> None:
+    """Updates the guild's configured timezone"""
+
+    guild = await get_guild_config(guild_id)
+    await query.update_guild_timezone(guild_id, timezone)
+    guild.timezone = timezone
+    _touch(guild)
+
+
+async def update_guild_category_mode(guild_id: int, enabled: bool) -> None:
+    """Turns the guild's category lock mode on or off"""
+
+    guild = await get_guild_config(guild_id)
+    await query.update_guild_category_mode(guild_id, enabled)
+    guild.category_mode = enabled
+    _touch(guild)
+
+
+async def update_guild_channel(
+    guild_id: int,
+    *,
+    channel_id: int,
+    time_lock: Optional[time] = None,
+    time_unlock: Optional[time] = None,
+    days: Optional[str] = None,
+) -> tuple:
+    """Updates a channel's lock/unlock times, or adds a new channel
+    Returns the same tuple as `query.update_guild_channel`"""
+
+    guild = await get_guild_config(guild_id)
+    add, lock, unlock, days = await query.update_guild_channel(
+        guild_id,
+        channel_id=channel_id,
+        time_lock=time_lock,
+        time_unlock=time_unlock,
+        days=days,
+    )
+
+    channel = guild.channels.get(channel_id)
+    if channel is None:
+        channel = guild.channels[channel_id] = ChannelConfig(
+            guild=guild_id, channel_id=channel_id
+        )
+        _channels[channel_id] = channel
+
+    channel.time_lock = lock
+    channel.time_unlock = unlock
+    channel.days = None if days is None else sys.intern(days)
+    channel.days_mask = model.days_mask(days)
+    _touch(guild)
+
+    return add, lock, unlock, days
+
+
+async def import_channels(
+    guild_id: int,
+    channels: Iterable[tuple[int, Optional[time], Optional[time], Optional[str]]],
+    *,
+    timezone: Optional[str] = None,
+    category_mode: Optional[bool] = None,
+    windows: Optional[dict[int, list[tuple]]] = None,
+    replace: bool = False,
+) -> dict[str, list[int]]:
+    """Apply a whole imported config in one transaction, the channels' times and
+    days are set exactly, `replace` removes the guild's channels not listed.
+    `windows` replaces the lock windows and exceptions of the channels it lists,
+    see `query.import_guild_channels`.
+    Returns the channel IDs that were added, changed, unchanged and removed"""
+
+    guild = await get_guild_config(guild_id)
+    channels = list(channels)
+    windows = windows or {}
+
+    diff = {"added": [], "changed": [], "unchanged": [], "removed": []}
+    for channel_id, time_lock, time_unlock, days in channels:
+        channel = guild.channels.get(channel_id)
+        if channel is None:
+            diff["added"].append(channel_id)
+        elif (channel.time_lock, channel.time_unlock, channel.days) != (
+            time_lock,
+            time_unlock,
+            days,
+        ) or (
+            channel_id in windows
+            and [_window_key(w) for w in channel.windows]
+            != [tuple(w) for w in windows[channel_id]]
+        ):
+            diff["changed"].append(channel_id)
+        else:
+            diff["unchanged"].append(channel_id)
+
+    if replace:
+        listed = {channel[0] for channel in channels}
+        diff["removed"] = [c for c in guild.channels if c not in listed]
+
+    unchanged = set(diff["unchanged"])
+    windows = {c: w for c, w in windows.items() if c not in unchanged}
+    schedules = await query.import_guild_channels(
+        guild_id,
+        [c for c in channels if c[0] not in unchanged],
+        timezone=timezone,
+        category_mode=category_mode,
+        windows=windows,
+        remove=diff["removed"],
+    )
+
+    if timezone is not None:
+        guild.timezone = timezone
+    if category_mode is not None:
+        guild.category_mode = category_mode
+
+    for channel_id, time_lock, time_unlock, days in channels:
+        channel = guild.channels.get(channel_id)
+        if channel is None:
+            channel = guild.channels[channel_id] = ChannelConfig(
+                guild=guild_id, channel_id=channel_id
+            )
+            _channels[channel_id] = channel
+
+        channel.time_lock = time_lock
+        channel.time_unlock = time_unlock
+        channel.days = None if days is None else sys.intern(days)
+        channel.days_mask = model.days_mask(days)
+
+    added = _group_windows(schedules)
+    for channel_id in windows:
+        guild.channels[channel_id].windows = added.get(channel_id, ())
+
+    for channel_id in diff["removed"]:
+        del guild.channels[channel_id]
+        _channels.pop(channel_id, None)
+        _pending_statuses.pop(channel_id, None)
+
+    _touch(guild)
+    return diff
+
+
+async def add_channel_schedule(
+    guild_id: int,
+    *,
+    channel_id: int,
+    time_lock: Optional[time] = None,
+    time_unlock: Optional[time] = None,
+    days: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    exception: bool = False,
+) -> ScheduleWindow:
+    """Add a lock window or exception to a channel, adding the channel if needed"""
+
+    channel = _channels.get(channel_id)
+    if channel is None:
+        await update_guild_channel(guild_id, channel_id=channel_id)
+        channel = _channels[channel_id]
+
+    row = await query.add_channel_schedule(
+        guild_id,
+        channel_id=channel_id,
+        time_lock=time_lock,
+        time_unlock=time_unlock,
+        days=days,
+        start_date=start_date,
+        end_date=end_date,
+        exception=exception,
+    )
+
+    window = ScheduleWindow.from_row(row)
+    channel.windows = (*channel.windows, window)
+    _touch(_guilds[channel.guild])
+    return window
+
+
+async def remove_channel_schedules(channel_id: int) -> int:
+    """Remove every lock window and exception of a channel, returns how many"""
+
+    await query.remove_channel_schedules(channel_id)
+
+    channel = _channels.get(channel_id)
+    if channel is None:
+        return 0
+
+    removed = len(channel.windows)
+    channel.windows = ()
+    if channel.guild in _guilds:
+        _touch(_guilds[channel.guild])
+    return removed
+
+
+async def add_guild(guild_id: int, timezone: Optional[str] = None) -> None:
+    """Add a new guild to the database"""
+
+    if guild_id in _guilds:
+        return
+
+    await query.add_guild(guild_id, timezone)
+    _guilds[guild_id] = GuildConfig(id=guild_id, timezone=timezone)
+
+
+async def add_guilds(guild_ids: Iterable[int]) -> None:
+    """Add every guild that is not cached yet with a single bulk insert"""
+
+    missing = [guild_id for guild_id in guild_ids if guild_id not in _guilds]
+    if not missing:
+        return
+
+    await query.add_guilds(missing)
+    for guild_id in missing:
+        _guilds.setdefault(guild_id, GuildConfig(id=guild_id))
+
+
+async def remove_channel(channel_id: int) -> None:
+    """Remove a channel from the guild's channels"""
+
+    await query.remove_channel(channel_id)
+
+    _pending_statuses.pop(channel_id, None)
+    channel = _channels.pop(channel_id, None)
+    if channel is not None and channel.guild in _guilds:
+        _guilds[channel.guild].channels.pop(channel_id, None)
+        _touch(_guilds[channel.guild])
+
+
+async def remove_guild(guild_id: int) -> list[int]:
+    """Remove a guild and its channels, returns the removed channel IDs"""
+
+    await query.remove_guild(guild_id)
+
+    guild = _guilds.pop(guild_id, None)
+    channel_ids = list(guild.channels) if guild else []
+    for channel_id in channel_ids:
+        _channels.pop(channel_id, None)
+        _pending_statuses.pop(channel_id, None)
+
+    return channel_ids
+
+
+async def update_channel_status(channel_id: int, *, is_unlocked: bool) -> None:
+    """Update a channels' lock/unlocked status
+
+    The cached record is updated immediately, the database write is queued
+    until the next `flush_channel_statuses`"""
+
+    channel = _channels.get(channel_id)
+    if channel is not None:
+        channel.unlocked = is_unlocked
+
+    _pending_statuses[channel_id] = is_unlocked
+
+
+async def flush_channel_statuses() -> None:
+    """Write every queued channel status to the database in one transaction"""
+
+    if not _pending_statuses:
+        return
+
+    statuses = list(_pending_statuses.items())
+    _pending_statuses.clear()
+
+    try:
+        await query.update_channel_statuses(statuses)
+    except Exception:
+        # requeue without clobbering statuses queued while the write was pending
+        for channel_id, is_unlocked in statuses:
+            _pending_statuses.setdefault(channel_id, is_unlocked)
+        raise
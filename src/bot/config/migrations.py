@@ -0,0 +1,142 @@
+"""Versioned schema migrations, applied in place without dropping data
+
+Every migration runs once, in order, inside one transaction and is recorded
+in the schema_version table. Migrations check the live schema before changing
+it, so databases created by older versions of the bot upgrade cleanly.
+
+usage: python -m bot.config.migrations
+"""
+
+import asyncio
+from typing import Callable
+
+from sqlalchemy import delete, func, insert, inspect, select, text, update
+from sqlalchemy.engine import Connection
+
+from bot.config.model import (
+    ALL_DAYS,
+    Base,
+    Channel,
+    ChannelSchedule,
+    Guild,
+    JournalEntry,
+    SchedulerLease,
+    SchemaVersion,
+    days_mask,
+    engine,
+)
+
+
+def _create_tables(conn: Connection) -> None:
+    """Create the guild and channel tables if they do not exist"""
+    Base.metadata.create_all(conn, tables=[Guild.__table__, Channel.__table__])
+
+
+def _add_days_mask(conn: Connection) -> None:
+    """Add channel.days_mask and backfill it from the stored days strings"""
+
+    columns = {c["name"] for c in inspect(conn).get_columns("channel")}
+    if "days_mask" in columns:
+        return
+
+    conn.execute(
+        text(
+            f"ALTER TABLE channel ADD COLUMN days_mask INTEGER NOT NULL DEFAULT {ALL_DAYS}"
+        )
+    )
+
+    for (days,) in conn.execute(select(Channel.days).distinct()).all():
+        try:
+            mask = days_mask(days)
+        except ValueError:
+            mask = ALL_DAYS
+
+        conn.execute(update(Channel).where(Channel.days == days).values(days_mask=mask))
+
+
+def _index_channels(conn: Connection) -> None:
+    """Drop duplicate channel rows and index channel_id and (guild, channel_id)"""
+
+    # keep the oldest row of every (guild, channel_id) pair
+    keep = select(func.min(Channel.id)).group_by(Channel.guild, Channel.channel_id)
+    conn.execute(delete(Channel).where(Channel.id.not_in(keep)))
+
+    for index in Channel.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _create_journal(conn: Connection) -> None:
+    """Create the action journal table"""
+    Base.metadata.create_all(conn, tables=[JournalEntry.__table__])
+
+
+def _create_channel_schedule(conn: Connection) -> None:
+    """Create the channel schedule table"""
+    Base.metadata.create_all(conn, tables=[ChannelSchedule.__table__])
+
+
+def _add_category_mode(conn: Connection) -> None:
+    """Add guild.category_mode, off for every existing guild"""
+
+    columns = {c["name"] for c in inspect(conn).get_columns("guild")}
+    if "category_mode" in columns:
+        return
+
+    conn.execute(
+        text(
+            "ALTER TABLE guild ADD COLUMN category_mode BOOLEAN NOT NULL DEFAULT false"
+        )
+    )
+
+
+def _create_leases(conn: Connection) -> None:
+    """Create the scheduler_lease table"""
+    Base.metadata.create_all(conn, tables=[SchedulerLease.__table__])
+
+
+# (version, description, migration), versions must only ever be appended
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "create guild and channel tables", _create_tables),
+    (2, "add channel.days_mask", _add_days_mask),
+    (3, "index and deduplicate channels", _index_channels),
+    (4, "create action journal", _create_journal),
+    (5, "create channel schedule", _create_channel_schedule),
+    (6, "add guild.category_mode", _add_category_mode),
+    (7, "create scheduler lease", _create_leases),
+]
+
+
+def _migrate(conn: Connection) -> list[int]:
+    """Apply every migration newer than the recorded schema version"""
+
+    SchemaVersion.__table__.create(conn, checkfirst=True)
+    current = conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+
+        migration(conn)
+        conn.execute(
+            insert(SchemaVersion).values(version=version, description=description)
+        )
+        print(f"Applied migration {version}: {description}")
+        applied.append(version)
+
+    return applied
+
+
+async def migrate() -> list[int]:
+    """Bring the database schema up to date, returns the applied versions"""
+
+    async with engine.begin() as conn:
+        applied = await conn.run_sync(_migrate)
+
+    await engine.dispose()
+    return applied
+
+
+if __name__ == "__main__":
+    applied = asyncio.run(migrate())
+    print(f"Database is up to date ({len(applied)} migration(s) applied)")
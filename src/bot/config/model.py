@@ -1,12 +1,66 @@
-from datetime import time
-
-from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, String, Time
+from datetime import date, time
+from itertools import chain
+from typing import Optional
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    Date,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Time,
+    event,
+)
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from bot import settings
 
 # constructing the Base class for declarative class definitions
 Base = declarative_base()
 
+# weekday mask with a bit set for every day, Monday being bit 0
+ALL_DAYS = 0b1111111
+
+
+def days_mask(days: Optional[str]) -> int:
+    """Compile a days string into a 7-bit weekday mask
+    Accepts a list (`0,2,4`), an inclusive range (`1-3`, `5-1` wraps) or a single day.
+    An empty value means every day. Raises ValueError if the string is invalid"""
+
+    if not days:
+        return ALL_DAYS
+
+    if "-" in days:
+        start, end = [int(d) for d in days.split("-")]
+        if start <= end:
+            weekdays = range(start, end + 1)
+        else:
+            weekdays = chain(range(start, 7), range(0, end + 1))
+        # the endpoints are listed too so a wrapped range still validates them
+        weekdays = [*weekdays, start, end]
+    else:
+        weekdays = [int(d) for d in days.split(",")]
+
+    mask = 0
+    for d in weekdays:
+        if not 0 <= d < 7:
+            raise ValueError(f"{d} is not a weekday number (0-6)")
+        mask |= 1 << d
+
+    return mask
+
+
+def should_run(days_mask: int, weekday: int) -> bool:
+    """Returns true if weekday is set in the compiled days mask"""
+    return bool(days_mask >> weekday & 1)
+
 
 class Guild(Base):
     """Represents the guild table"""
@@ -18,6 +72,8 @@ class Guild(Base):
         primary_key=True,
     )
     timezone: str = Column(String(30), nullable=True, default=None)
+    # lock synced channels of a category through the category's overwrite
+    category_mode: bool = Column(Boolean, nullable=False, default=False)
     channels = relationship("Channel")
 
     __mapper_args__ = {"eager_defaults": True}
@@ -35,18 +91,114 @@ class Channel(Base):
     time_unlock: time = Column(Time, nullable=True, default=None)
     unlocked: bool = Column(Boolean, nullable=False, default=True)
     days: str = Column(String(20), nullable=True, default=None)
+    days_mask: int = Column(Integer, nullable=False, default=ALL_DAYS)
 
+    __table_args__ = (
+        Index("ix_channel_guild_channel_id", "guild", "channel_id", unique=True),
+        Index("ix_channel_channel_id", "channel_id"),
+    )
 
-engine = create_async_engine("sqlite+aiosqlite:///bot/config/config.sqlite3")
 
+class ChannelSchedule(Base):
+    """Represents the channel_schedule table, extra lock windows and exceptions
+    of a configured channel
 
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    A window locks the channel at time_lock and unlocks it at time_unlock, on the
+    next day if that is earlier, for every matching weekday within the optional
+    date range. An exception (no times) suspends the channel's whole schedule on
+    the dates of its range."""
+
+    __tablename__ = "channel_schedule"
+
+    id: int = Column(Integer, primary_key=True)
+    guild: int = Column(BigInteger, nullable=False)
+    channel_id: int = Column(BigInteger, nullable=False, index=True)
+    time_lock: time = Column(Time, nullable=True, default=None)
+    time_unlock: time = Column(Time, nullable=True, default=None)
+    days: str = Column(String(20), nullable=True, default=None)
+    days_mask: int = Column(Integer, nullable=False, default=ALL_DAYS)
+    # inclusive local dates, open ended when None
+    start_date: date = Column(Date, nullable=True, default=None)
+    end_date: date = Column(Date, nullable=True, default=None)
+    exception: bool = Column(Boolean, nullable=False, default=False)
+
+
+class JournalEntry(Base):
+    """Represents the action_journal table, one row per lock/unlock the bot set out
+    to apply, completed once the channel's new status has been stored"""
+
+    __tablename__ = "action_journal"
 
+    id: int = Column(Integer, primary_key=True)
+    guild: int = Column(BigInteger, nullable=False)
+    channel_id: int = Column(BigInteger, nullable=False)
+    unlock: bool = Column(Boolean, nullable=False)
+    # epoch of the scheduled transition and of the journal write
+    due: int = Column(BigInteger, nullable=False)
+    created: int = Column(BigInteger, nullable=False)
+    completed: bool = Column(Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        Index("ix_action_journal_completed_channel_id", "completed", "channel_id"),
+    )
+
+
+class SchedulerLease(Base):
+    """Represents the scheduler_lease table, one row per shard whose scheduling is
+    owned by the process holding the lease"""
+
+    __tablename__ = "scheduler_lease"
+
+    name: str = Column(String(50), primary_key=True)
+    owner: str = Column(String(100), nullable=False)
+    # epoch the lease lapses at unless its owner renews it
+    expires: float = Column(Float, nullable=False)
+
+
+class SchemaVersion(Base):
+    """Represents the schema_version table, one row per applied migration"""
+
+    __tablename__ = "schema_version"
+
+    version: int = Column(Integer, primary_key=True, autoincrement=False)
+    description: str = Column(String(100), nullable=False)
 
-async def create():
-    """create the table and rows if they do not exist"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
 
-    await engine.dispose()
+def _engine_options(url: str) -> dict:
+    """Returns the create_async_engine options for the database backend"""
+    url = make_url(url)
+    pool = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+    }
+
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            # every connection would get its own in-memory database
+            return {}
+
+        # SQLAlchemy opens a new file connection per session by default, pool
+        # them so the pragmas and the page cache outlive a single query
+        return {"poolclass": AsyncAdaptedQueuePool, **pool}
+
+    return {**pool, "pool_pre_ping": True}
+
+
+engine = create_async_engine(
+    settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL)
+)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Apply WAL mode and the tuned pragmas to every new SQLite connection"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    cursor = dbapi_connection.cursor()
+    for pragma, value in settings.SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
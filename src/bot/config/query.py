@@ -1,13 +1,27 @@
-from datetime import time
+from datetime import date, datetime, time
+from itertools import islice
 from optparse import Option
-from typing import Optional
-
-from bot.config.model import Channel, Guild, async_session
-from sqlalchemy import delete
+from typing import AsyncIterator, Iterable, Optional
+
+from bot.config.model import (
+    Channel,
+    ChannelSchedule,
+    Guild,
+    JournalEntry,
+    SchedulerLease,
+    async_session,
+    days_mask,
+    engine,
+)
+from bot.metrics import QUERY_SECONDS, timed
+from sqlalchemy import BigInteger, delete, func, literal_column, or_, update
+from sqlalchemy.engine import Row
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 
+@timed(QUERY_SECONDS)
 async def get_guild_config(guild_id: int) -> Guild:
     """Returns a Guild database object"""
 
@@ -23,6 +37,7 @@ async def get_guild_config(guild_id: int) -> Guild:
     return result.scalars().first()
 
 
+@timed(QUERY_SECONDS)
 async def update_guild_timezone(guild_id: int, timezone: str) -> None:
     """Updates the guild's configured timezone"""
 
@@ -40,13 +55,26 @@ async def update_guild_timezone(guild_id: int, timezone: str) -> None:
             await session.commit()
 
 
+@timed(QUERY_SECONDS)
+async def update_guild_category_mode(guild_id: int, enabled: bool) -> None:
+    """Turns the guild's category lock mode on or off"""
+
+    async with async_session() as session:
+        async with session.begin():
+
+            await session.execute(
+                update(Guild).where(Guild.id == guild_id).values(category_mode=enabled)
+            )
+
+
+@timed(QUERY_SECONDS)
 async def update_guild_channel(
     guild_id: int,
     *,
     channel_id: int,
     time_lock: Optional[time] = None,
     time_unlock: Optional[time] = None,
-    days: Optional[str] = None
+    days: Optional[str] = None,
 ) -> tuple:
     """Updates a channel's lock/unlock times, or adds a new channel
     Returns True if a new channel was added, or false if a channel was updated"""
@@ -63,15 +91,15 @@ async def update_guild_channel(
             channel = result.scalars().first()
 
             if channel is None:
-                session.add(
-                    Channel(
-                        guild=guild_id,
-                        channel_id=channel_id,
-                        time_lock=time_lock,
-                        time_unlock=time_unlock,
-                        days=days,
-                    )
+                channel = Channel(
+                    guild=guild_id,
+                    channel_id=channel_id,
+                    time_lock=time_lock,
+                    time_unlock=time_unlock,
+                    days=days,
+                    days_mask=days_mask(days),
                 )
+                session.add(channel)
                 add = True
 
             else:
@@ -83,14 +111,16 @@ async def update_guild_channel(
 
                 if channel.days != days and not days is None:
                     channel.days = days
+                    channel.days_mask = days_mask(days)
 
                 add = False
 
         await session.commit()
 
-    return add, channel.time_lock, channel.time_unlock, days
+    return add, channel.time_lock, channel.time_unlock, channel.days
 
 
+@timed(QUERY_SECONDS)
 async def add_guild(guild_id: int, timezone: Optional[str] = None) -> None:
     """Add a new guild to the database"""
 
@@ -109,6 +139,31 @@ async def add_guild(guild_id: int, timezone: Optional[str] = None) -> None:
         await session.commit()
 
 
+def insert(table):
+    """Returns the backend's INSERT construct, which supports ON CONFLICT"""
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+@timed(QUERY_SECONDS)
+async def add_guilds(guild_ids: Iterable[int], *, chunk_size: int = 500) -> None:
+    """Add many guilds in one transaction, skipping the ones that already exist"""
+
+    ids = iter(set(guild_ids))
+
+    async with async_session() as session:
+        async with session.begin():
+
+            while chunk := list(islice(ids, chunk_size)):
+                await session.execute(
+                    insert(Guild)
+                    .values([{"id": guild_id} for guild_id in chunk])
+                    .on_conflict_do_nothing(index_elements=[Guild.id])
+                )
+
+
+@timed(QUERY_SECONDS)
 async def get_channel_ids(guild_id: int) -> list[int]:
     """Return a list of configured channel IDs for the guild"""
 
@@ -122,6 +177,7 @@ async def get_channel_ids(guild_id: int) -> list[int]:
             return [c.channel_id for c in result.scalars()]
 
 
+@timed(QUERY_SECONDS)
 async def remove_channel(channel_id: int) -> None:
     """Remove a channel from the guild's channels"""
 
@@ -131,38 +187,449 @@ async def remove_channel(channel_id: int) -> None:
             await session.execute(
                 delete(Channel).where(Channel.channel_id == channel_id)
             )
+            await session.execute(
+                delete(ChannelSchedule).where(ChannelSchedule.channel_id == channel_id)
+            )
+            await session.execute(_complete_journal([channel_id]))
 
             await session.commit()
 
 
-async def get_guild_configs() -> Guild:
-    """Gets and returns all guilds and associated channels from the table"""
+@timed(QUERY_SECONDS)
+async def remove_guild(guild_id: int) -> None:
+    """Remove a guild and all of its channels"""
 
     async with async_session() as session:
         async with session.begin():
 
-            result = await session.execute(
-                select(Guild).options(selectinload(Guild.channels))
+            await session.execute(delete(Channel).where(Channel.guild == guild_id))
+            await session.execute(
+                delete(ChannelSchedule).where(ChannelSchedule.guild == guild_id)
+            )
+            await session.execute(
+                update(JournalEntry)
+                .where(JournalEntry.guild == guild_id)
+                .values(completed=True)
+            )
+            await session.execute(delete(Guild).where(Guild.id == guild_id))
+
+            await session.commit()
+
+
+@timed(QUERY_SECONDS)
+async def add_channel_schedule(
+    guild_id: int,
+    *,
+    channel_id: int,
+    time_lock: Optional[time] = None,
+    time_unlock: Optional[time] = None,
+    days: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    exception: bool = False,
+) -> ChannelSchedule:
+    """Add a lock window, or an exception if `exception` is set, to a channel"""
+
+    schedule = ChannelSchedule(
+        guild=guild_id,
+        channel_id=channel_id,
+        time_lock=time_lock,
+        time_unlock=time_unlock,
+        days=days,
+        days_mask=days_mask(days),
+        start_date=start_date,
+        end_date=end_date,
+        exception=exception,
+    )
+
+    async with async_session() as session:
+        async with session.begin():
+
+            session.add(schedule)
+
+    return schedule
+
+
+@timed(QUERY_SECONDS)
+async def remove_channel_schedules(channel_id: int) -> None:
+    """Remove every lock window and exception of a channel"""
+
+    async with async_session() as session:
+        async with session.begin():
+
+            await session.execute(
+                delete(ChannelSchedule).where(ChannelSchedule.channel_id == channel_id)
+            )
+
+
+@timed(QUERY_SECONDS)
+async def get_channel_schedules(
+    shard_ids: Optional[Iterable[int]] = None,
+    shard_count: Optional[int] = None,
+    *,
+    guild_id: Optional[int] = None,
+) -> list[ChannelSchedule]:
+    """Returns the lock windows and exceptions of every channel, or only those of
+    the given shards or guild, ordered by channel"""
+
+    statement = select(ChannelSchedule).order_by(
+        ChannelSchedule.channel_id, ChannelSchedule.id
+    )
+    if guild_id is not None:
+        statement = statement.where(ChannelSchedule.guild == guild_id)
+    elif shard_ids is not None and shard_count:
+        statement = statement.join(Guild, Guild.id == ChannelSchedule.guild).where(
+            in_shards(shard_ids, shard_count)
+        )
+
+    async with async_session() as session:
+        result = await session.execute(statement)
+        return result.scalars().all()
+
+
+@timed(QUERY_SECONDS)
+async def import_guild_channels(
+    guild_id: int,
+    channels: Iterable[tuple[int, Optional[time], Optional[time], Optional[str]]],
+    *,
+    timezone: Optional[str] = None,
+    category_mode: Optional[bool] = None,
+    windows: Optional[dict[int, list[tuple]]] = None,
+    remove: Iterable[int] = (),
+    chunk_size: int = 500,
+) -> list[ChannelSchedule]:
+    """Upsert many (channel_id, time_lock, time_unlock, days) channels of a guild,
+    optionally set its timezone and category mode, replace the windows of some
+    channels and remove other channels, in one transaction
+
+    `windows` maps a channel ID to its (time_lock, time_unlock, days, start_date,
+    end_date, exception) windows. Returns the windows that were added"""
+
+    rows = [
+        {
+            "guild": guild_id,
+            "channel_id": channel_id,
+            "time_lock": time_lock,
+            "time_unlock": time_unlock,
+            "days": days,
+            "days_mask": days_mask(days),
+        }
+        for channel_id, time_lock, time_unlock, days in channels
+    ]
+    remove = list(remove)
+
+    async with async_session() as session:
+        async with session.begin():
+
+            await session.execute(
+                insert(Guild)
+                .values(id=guild_id, timezone=timezone)
+                .on_conflict_do_nothing(index_elements=[Guild.id])
             )
+            values = {"timezone": timezone, "category_mode": category_mode}
+            values = {key: value for key, value in values.items() if value is not None}
+            if values:
+                await session.execute(
+                    update(Guild).where(Guild.id == guild_id).values(**values)
+                )
+
+            for i in range(0, len(rows), chunk_size):
+                statement = insert(Channel).values(rows[i : i + chunk_size])
+                await session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=[Channel.guild, Channel.channel_id],
+                        set_={
+                            key: statement.excluded[key]
+                            for key in ("time_lock", "time_unlock", "days", "days_mask")
+                        },
+                    )
+                )
+
+            for i in range(0, len(remove), chunk_size):
+                chunk = remove[i : i + chunk_size]
+                await session.execute(
+                    delete(Channel).where(
+                        Channel.guild == guild_id, Channel.channel_id.in_(chunk)
+                    )
+                )
+                await session.execute(
+                    delete(ChannelSchedule).where(ChannelSchedule.channel_id.in_(chunk))
+                )
+                await session.execute(_complete_journal(chunk))
+
+            replaced = list(windows or {})
+            for i in range(0, len(replaced), chunk_size):
+                await session.execute(
+                    delete(ChannelSchedule).where(
+                        ChannelSchedule.channel_id.in_(replaced[i : i + chunk_size])
+                    )
+                )
+
+            schedules = [
+                ChannelSchedule(
+                    guild=guild_id,
+                    channel_id=channel_id,
+                    time_lock=time_lock,
+                    time_unlock=time_unlock,
+                    days=days,
+                    days_mask=days_mask(days),
+                    start_date=start_date,
+                    end_date=end_date,
+                    exception=exception,
+                )
+                for channel_id, listed in (windows or {}).items()
+                for time_lock, time_unlock, days, start_date, end_date, exception in listed
+            ]
+            session.add_all(schedules)
+
+    return schedules
+
+
+def in_shards(shard_ids: Iterable[int], shard_count: int):
+    """Returns a where clause matching the guilds that belong to the given shards"""
+    # inline, PostgreSQL has no bigint >> bigint for a bound parameter
+    shard = (
+        Guild.id.op(">>", return_type=BigInteger)(literal_column("22")) % shard_count
+    )
+    return shard.in_(list(shard_ids))
+
+
+@timed(QUERY_SECONDS)
+async def get_guild_configs(
+    shard_ids: Optional[Iterable[int]] = None, shard_count: Optional[int] = None
+) -> Guild:
+    """Gets and returns all guilds and associated channels from the table
+    Only the guilds of the given shards are returned when both are given"""
+
+    statement = select(Guild).options(selectinload(Guild.channels))
+    if shard_ids is not None and shard_count:
+        statement = statement.where(in_shards(shard_ids, shard_count))
+
+    async with async_session() as session:
+        async with session.begin():
+
+            result = await session.execute(statement)
 
             return result.scalars()
 
 
-async def update_channel_status(channel_id: int, *, is_unlocked: bool) -> None:
-    """Update a channels' lock/unlocked status"""
+async def stream_channel_schedules(
+    shard_ids: Optional[Iterable[int]] = None,
+    shard_count: Optional[int] = None,
+    *,
+    chunk_size: int = 1000,
+) -> AsyncIterator[list[Row]]:
+    """Yields the scheduler's columns for every guild and channel in chunks,
+    streamed from a server-side cursor instead of loading ORM objects
+
+    Rows are (guild_id, timezone, category_mode, channel_id, time_lock,
+    time_unlock, unlocked, days, days_mask) ordered by guild, the channel columns
+    are None for guilds without channels"""
+
+    statement = (
+        select(
+            Guild.id,
+            Guild.timezone,
+            Guild.category_mode,
+            Channel.channel_id,
+            Channel.time_lock,
+            Channel.time_unlock,
+            Channel.unlocked,
+            Channel.days,
+            Channel.days_mask,
+        )
+        .outerjoin(Channel, Channel.guild == Guild.id)
+        .order_by(Guild.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    if shard_ids is not None and shard_count:
+        statement = statement.where(in_shards(shard_ids, shard_count))
+
+    async with async_session() as session:
+        result = await session.stream(statement)
+
+        async for partition in result.partitions(chunk_size):
+            yield partition
+
+
+@timed(QUERY_SECONDS)
+async def update_channel_statuses(
+    statuses: Iterable[tuple[int, bool]], *, chunk_size: int = 500
+) -> None:
+    """Update many channels' lock/unlocked status in a single transaction
+    with one UPDATE ... WHERE channel_id IN (...) per status and chunk.
+    Their pending action journal entries are completed in the same transaction"""
+
+    grouped = {True: [], False: []}
+    for channel_id, is_unlocked in statuses:
+        grouped[bool(is_unlocked)].append(channel_id)
+
+    if not grouped[True] and not grouped[False]:
+        return
 
     async with async_session() as session:
         async with session.begin():
 
-            result = await session.execute(
-                select(Channel).where(Channel.channel_id == channel_id)
+            for is_unlocked, channel_ids in grouped.items():
+                ids = iter(channel_ids)
+                while chunk := list(islice(ids, chunk_size)):
+                    await session.execute(
+                        update(Channel)
+                        .where(Channel.channel_id.in_(chunk))
+                        .values(unlocked=is_unlocked)
+                        .execution_options(synchronize_session=False)
+                    )
+
+                    # the stored status is what the journaled actions set out to reach
+                    await session.execute(_complete_journal(chunk))
+
+
+def _complete_journal(channel_ids: list[int]):
+    """Returns an UPDATE completing every pending journal entry of the channels"""
+    return (
+        update(JournalEntry)
+        .where(
+            JournalEntry.completed == False, JournalEntry.channel_id.in_(channel_ids)
+        )
+        .values(completed=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+@timed(QUERY_SECONDS)
+async def add_journal_entries(entries: Iterable[tuple[int, int, bool, int]]) -> None:
+    """Record (guild_id, channel_id, unlock, due) actions before they are applied"""
+
+    created = int(datetime.now().timestamp())
+    rows = [
+        {
+            "guild": guild_id,
+            "channel_id": channel_id,
+            "unlock": unlock,
+            "due": due,
+            "created": created,
+        }
+        for guild_id, channel_id, unlock, due in entries
+    ]
+    if not rows:
+        return
+
+    async with async_session() as session:
+        async with session.begin():
+
+            await session.execute(insert(JournalEntry), rows)
+
+
+@timed(QUERY_SECONDS)
+async def complete_journal_entries(
+    channel_ids: Iterable[int], *, chunk_size: int = 500
+) -> None:
+    """Complete the pending journal entries of channels that need no action"""
+
+    ids = iter(channel_ids)
+    async with async_session() as session:
+        async with session.begin():
+
+            while chunk := list(islice(ids, chunk_size)):
+                await session.execute(_complete_journal(chunk))
+
+
+def _pending_journal(statement, shard_ids, shard_count):
+    """Restricts a journal select to pending entries, of the given shards' guilds
+    when both are given"""
+
+    statement = statement.where(JournalEntry.completed == False)
+    if shard_ids is not None and shard_count:
+        statement = statement.join(Guild, Guild.id == JournalEntry.guild).where(
+            in_shards(shard_ids, shard_count)
+        )
+    return statement
+
+
+@timed(QUERY_SECONDS)
+async def get_last_pending_journal_id(
+    shard_ids: Optional[Iterable[int]] = None, shard_count: Optional[int] = None
+) -> Optional[int]:
+    """Returns the highest ID of a pending journal entry, None if there is none
+    Only the entries of the given shards' guilds count when both are given"""
+
+    statement = _pending_journal(
+        select(func.max(JournalEntry.id)), shard_ids, shard_count
+    )
+
+    async with async_session() as session:
+        result = await session.execute(statement)
+        return result.scalar()
+
+
+@timed(QUERY_SECONDS)
+async def get_pending_journal_entries(
+    shard_ids: Optional[Iterable[int]] = None,
+    shard_count: Optional[int] = None,
+    *,
+    after: int = 0,
+    until: Optional[int] = None,
+    limit: int = 500,
+) -> list[JournalEntry]:
+    """Returns up to `limit` pending journal entries with an ID above `after`, and
+    at most `until` when given, oldest first. Only the entries of the given shards'
+    guilds are returned when both are given"""
+
+    statement = _pending_journal(select(JournalEntry), shard_ids, shard_count).where(
+        JournalEntry.id > after
+    )
+    if until is not None:
+        statement = statement.where(JournalEntry.id <= until)
+
+    async with async_session() as session:
+        result = await session.execute(statement.order_by(JournalEntry.id).limit(limit))
+        return result.scalars().all()
+
+
+@timed(QUERY_SECONDS)
+async def prune_journal(before: int) -> None:
+    """Delete completed journal entries written before the `before` epoch"""
+
+    async with async_session() as session:
+        async with session.begin():
+
+            await session.execute(
+                delete(JournalEntry).where(
+                    JournalEntry.completed == True, JournalEntry.created < before
+                )
             )
 
-            channel = result.scalars().first()
 
-            if channel is None:
-                return
+@timed(QUERY_SECONDS)
+async def acquire_leases(
+    names: list[str], owner: str, *, now: float, ttl: float
+) -> list[str]:
+    """Renew the owner's leases and take over the ones that have lapsed, in one
+    transaction. Returns the names of the leases the owner now holds"""
 
-            channel.unlocked = is_unlocked
+    async with async_session() as session:
+        async with session.begin():
 
-            await session.commit()
+            await session.execute(
+                insert(SchedulerLease)
+                .values([{"name": n, "owner": owner, "expires": 0} for n in names])
+                .on_conflict_do_nothing(index_elements=[SchedulerLease.name])
+            )
+
+            # the condition is re-checked against a row another process just
+            # renewed, so only one process can take a lapsed lease
+            await session.execute(
+                update(SchedulerLease)
+                .where(
+                    SchedulerLease.name.in_(names),
+                    or_(SchedulerLease.owner == owner, SchedulerLease.expires < now),
+                )
+                .values(owner=owner, expires=now + ttl)
+            )
+
+            result = await session.execute(
+                select(SchedulerLease.name).where(
+                    SchedulerLease.name.in_(names), SchedulerLease.owner == owner
+                )
+            )
+            return result.scalars().all()
@@ -0,0 +1,243 @@
+"""Prometheus-style counters and histograms for the scheduler, queries and Discord calls
+
+Metrics are kept in process and rendered in the Prometheus text format by
+`render`, which `start_server` exposes on a local /metrics endpoint.
+"""
+
+import bisect
+import time
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from aiohttp import web
+
+# default latency buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry: list = []
+
+
+def _labels(labelnames: tuple, labels: dict) -> tuple:
+    """Order label values by the metric's label names"""
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Iterable[str], values: Iterable[str], **extra) -> str:
+    """Render labels as {name="value",...}, empty if there are none"""
+    pairs = [*zip(labelnames, values), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    """A monotonically increasing value per label set"""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels(self.labelnames, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_labels(self.labelnames, labels), 0)
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callback every time the metrics are rendered"""
+
+    def __init__(self, name: str, help: str, callback: Callable[[], float]) -> None:
+        self.name = name
+        self.help = help
+        self.callback = callback
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.callback()}",
+        ]
+
+
+class _Series:
+    """Bucket counts, sum and count of one histogram label set"""
+
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self, size: int) -> None:
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """Observations counted into fixed buckets per label set"""
+
+    def __init__(
+        self, name: str, help: str, labelnames: tuple = (), buckets: tuple = BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.bounds = tuple(buckets)
+        self.series: dict[tuple, _Series] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(self.labelnames, labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = _Series(len(self.bounds) + 1)
+
+        series.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def count(self, **labels) -> int:
+        """Number of observations, over every label set if none are given"""
+        if labels:
+            series = self.series.get(_labels(self.labelnames, labels))
+            return series.count if series else 0
+        return sum(s.count for s in self.series.values())
+
+    def mean(self, **labels) -> Optional[float]:
+        """Mean observation, over every label set if none are given"""
+        selected = self._select(labels)
+        count = sum(s.count for s in selected)
+        return sum(s.sum for s in selected) / count if count else None
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th quantile, None if empty"""
+        selected = self._select(labels)
+        count = sum(s.count for s in selected)
+        if not count:
+            return None
+
+        rank = q * count
+        seen = 0
+        for i, bound in enumerate((*self.bounds, float("inf"))):
+            seen += sum(s.buckets[i] for s in selected)
+            if seen >= rank:
+                return bound
+
+        return float("inf")
+
+    def _select(self, labels: dict) -> list[_Series]:
+        if labels:
+            series = self.series.get(_labels(self.labelnames, labels))
+            return [series] if series else []
+        return list(self.series.values())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.bounds, "+Inf"), series.buckets):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, le=bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series.sum}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+
+def timed(histogram: Histogram, **labels) -> Callable:
+    """Decorate a coroutine function to observe its duration in the histogram
+    The `name` label is filled with the function's name when it is not given"""
+
+    def decorator(func):
+        func_labels = dict(labels)
+        if "name" in histogram.labelnames:
+            func_labels.setdefault("name", func.__name__)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **func_labels)
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """Serve the metrics on http://host:port/metrics"""
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+TICK_SECONDS = Histogram(
+    "channelstatus_scheduler_tick_seconds",
+    "Time spent handling one batch of due channels",
+)
+CHANNELS = Counter(
+    "channelstatus_scheduler_channels_total",
+    "Channels handed to the scheduler callback, by outcome",
+    ("result",),
+)
+ACTION_LATENESS = Histogram(
+    "channelstatus_action_lateness_seconds",
+    "Delay between a channel's configured time and its action starting",
+)
+ACTION_SECONDS = Histogram(
+    "channelstatus_action_seconds",
+    "Time taken by a single lock or unlock action",
+)
+QUERY_SECONDS = Histogram(
+    "channelstatus_query_seconds",
+    "Time spent in a bot.config.query function",
+    ("name",),
+)
+DISCORD_CALLS = Counter(
+    "channelstatus_discord_api_calls_total",
+    "Discord API calls made by scheduled actions",
+    ("route",),
+)
+DISCORD_ERRORS = Counter(
+    "channelstatus_discord_api_errors_total",
+    "Discord API calls made by scheduled actions that raised",
+    ("route",),
+)
+DISCORD_SKIPPED = Counter(
+    "channelstatus_discord_api_skipped_total",
+    "Discord API calls skipped because they would not change anything",
+    ("route",),
+)
@@ -0,0 +1,4 @@
+from .executor import ActionExecutor, ActionResult
+from .lease import Leases
+from .planner import Plan, RenameQueue
+from .scheduler import Scheduler, Transition
@@ -0,0 +1,57 @@
+"""Bounded-concurrency execution of Discord lock/unlock actions"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable, Iterable, NamedTuple, Optional
+
+Action = Callable[[], Awaitable[None]]
+
+
+class ActionResult(NamedTuple):
+    """Outcome of a single action"""
+
+    guild_id: int
+    key: Hashable
+    latency: float
+    error: Optional[BaseException]
+
+
+class ActionExecutor:
+    """Runs actions for different guilds in parallel and the actions of one
+    guild in order
+
+    Each guild gets a single worker so a burst never hits the same guild's
+    routes concurrently, and at most `max_concurrency` workers run at once.
+    Per-route buckets and 429 retries are left to disnake's HTTP client."""
+
+    def __init__(self, max_concurrency: int = 8) -> None:
+        self.max_concurrency = max_concurrency
+
+    async def run(
+        self, actions: Iterable[tuple[int, Hashable, Action]]
+    ) -> list[ActionResult]:
+        """Run (guild_id, key, action) triples and return one result per action"""
+
+        queues: dict[int, list[tuple[Hashable, Action]]] = {}
+        for guild_id, key, action in actions:
+            queues.setdefault(guild_id, []).append((key, action))
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results: list[ActionResult] = []
+
+        async def worker(guild_id: int, queue: list[tuple[Hashable, Action]]):
+            async with semaphore:
+                for key, action in queue:
+                    start = time.perf_counter()
+                    error = None
+                    try:
+                        await action()
+                    except Exception as e:
+                        error = e
+
+                    results.append(
+                        ActionResult(guild_id, key, time.perf_counter() - start, error)
+                    )
+
+        await asyncio.gather(*(worker(g, q) for g, q in queues.items()))
+        return results
@@ -0,0 +1,112 @@
+"""Durable journal of the lock/unlock actions the bot sets out to apply
+
+Actions are journaled before any Discord call is made and completed in the same
+transaction that stores the channels' new statuses, so an entry left pending
+means the process stopped somewhere in between. On startup the pending entries
+are replayed in batches, which repairs those channels without auditing all of
+them. Applying an action twice is harmless as the planner skips calls that would
+not change anything.
+
+Replayed actions are journaled again when they are applied, so a replay only
+pages up to the last entry that was pending when it started. An action that
+fails again is given up on and left to the schedule and reconciliation.
+
+A process only replays the entries of its own shards. Entries of guilds it does
+not have cached, or whose shard lease another process holds, are left pending
+for the process that acts on them.
+"""
+
+import time
+from typing import Callable, Iterable, Optional
+
+from bot.config import cache, query
+from bot.scheduler.scheduler import Scheduler, Transition, previous_transition
+
+
+async def record(transitions: Iterable[Transition]) -> None:
+    """Journal the transitions that are about to be applied"""
+    await query.add_journal_entries(
+        (t.channel.guild, t.channel.channel_id, t.unlock, t.when) for t in transitions
+    )
+
+
+async def replay(
+    scheduler: Scheduler,
+    shard_ids: Optional[Iterable[int]] = None,
+    shard_count: Optional[int] = None,
+    *,
+    owns: Optional[Callable[[int], bool]] = None,
+    batch_size: int = 500,
+) -> int:
+    """Apply the pending journal entries of the given shards, or of every shard,
+    through the scheduler, `batch_size` at a time, returns the number of channels
+    replayed. Only the guilds that `owns` accepts are replayed when it is given
+
+    Entries for channels that are gone, already in the journaled state or that
+    have passed another transition since are completed without an action, the
+    latter are left to reconciliation."""
+
+    if shard_ids is not None:
+        shard_ids = list(shard_ids)
+
+    now = time.time()
+    after = 0
+    replayed = 0
+
+    # entries written by the replay itself are not replayed again
+    until = await query.get_last_pending_journal_id(shard_ids, shard_count)
+    if until is None:
+        return 0
+
+    while entries := await query.get_pending_journal_entries(
+        shard_ids, shard_count, after=after, until=until, limit=batch_size
+    ):
+        after = entries[-1].id
+
+        # only the latest entry of a channel matters, older ones complete with it
+        latest = {entry.channel_id: entry for entry in entries}
+
+        due = []
+        stale = []
+        for entry in latest.values():
+            guild = cache.get_guild(entry.guild)
+            if guild is None or (owns is not None and not owns(entry.guild)):
+                # not acted on by this process, the entry is not its to complete
+                continue
+
+            channel = cache.get_channel(entry.channel_id)
+            if channel is None or channel.unlocked == entry.unlock:
+                stale.append(entry.channel_id)
+                continue
+
+            prev = previous_transition(channel, guild.timezone, now)
+            if prev is not None and prev[0] > entry.due:
+                stale.append(entry.channel_id)
+                continue
+
+            due.append(Transition(channel, entry.unlock, entry.due))
+
+        if stale:
+            await query.complete_journal_entries(stale)
+
+        await scheduler.fire(due)
+        replayed += len(due)
+
+        # complete the entries of actions that failed, or they stay pending forever
+        # unless the lease was lost meanwhile and the new holder has to finish them
+        failed = [
+            t.channel.channel_id
+            for t in due
+            if t.channel.unlocked != t.unlock
+            and (owns is None or owns(t.channel.guild))
+        ]
+        if failed:
+            print(f"Gave up replaying {len(failed)} channel action(s) that failed")
+            await query.complete_journal_entries(failed)
+
+    return replayed
+
+
+async def prune(retention: float) -> None:
+    """Delete completed entries older than `retention` seconds"""
+    await query.prune_journal(int(time.time() - retention))
@@ -0,0 +1,87 @@
+"""Leases that let several processes run for the same shards without double firing
+
+With coordination on, each shard's scheduling is owned by the process holding
+the shard's row in the scheduler_lease table. The holder renews its leases every
+heartbeat and a standby takes a lease over once it has gone `ttl` seconds without
+renewal, so a failed holder is replaced within `ttl` plus one heartbeat.
+
+A holder stops acting on a shard as soon as its own last successful renewal is
+older than `ttl` less `margin`, before any standby can take the lease, as long as
+the hosts' clocks are less than `margin` seconds apart.
+"""
+
+import time
+from typing import Iterable
+
+from bot import metrics
+from bot.config import query
+
+COORDINATION_MODES = ("off", "lease")
+
+
+def lease_name(shard_id: int, shard_count: int) -> str:
+    """Name of a shard's lease, a different shard count means different leases"""
+    return f"shard:{shard_id}/{shard_count}"
+
+
+class Leases:
+    """The shard leases held by this process"""
+
+    def __init__(self, owner: str, *, ttl: float = 30, margin: float = 5) -> None:
+        if margin >= ttl:
+            raise ValueError("the lease margin must be shorter than its ttl")
+
+        self.owner = owner
+        self.ttl = ttl
+        self.margin = margin
+        self.shard_count = 1
+        # shard_id -> monotonic time this process stops acting on it
+        self._held: dict[int, float] = {}
+
+        metrics.Gauge(
+            "channelstatus_scheduler_leases_held",
+            "Shard leases held by this process",
+            lambda: len(self.held()),
+        )
+
+    def held(self) -> set[int]:
+        """The shards this process may currently act on"""
+        now = time.monotonic()
+        return {shard for shard, deadline in self._held.items() if deadline > now}
+
+    def owns(self, guild_id: int) -> bool:
+        """True if this process holds the lease of the guild's shard"""
+        deadline = self._held.get((guild_id >> 22) % self.shard_count)
+        return deadline is not None and deadline > time.monotonic()
+
+    async def heartbeat(
+        self, shard_ids: Iterable[int], shard_count: int
+    ) -> tuple[set[int], set[int]]:
+        """Renew the held leases and take over lapsed ones among the shards
+        Returns the shards that were gained and lost since the last heartbeat"""
+
+        shard_ids = list(shard_ids)
+        # a lease that lapsed locally counts as gained again once renewed, the
+        # shard may have changed hands in between
+        before, recorded = self.held(), set(self._held)
+        started = time.monotonic()
+
+        names = await query.acquire_leases(
+            [lease_name(s, shard_count) for s in shard_ids],
+            self.owner,
+            now=time.time(),
+            ttl=self.ttl,
+        )
+
+        # measured from before the request, the database may have seen it later
+        deadline = started + self.ttl - self.margin
+        acquired = set(names)
+        self.shard_count = shard_count
+        self._held = {
+            shard: deadline
+            for shard in shard_ids
+            if lease_name(shard, shard_count) in acquired
+        }
+
+        held = set(self._held)
+        return held - before, recorded - held
@@ -0,0 +1,257 @@
+"""Plan lock/unlock actions by diffing a channel's current state against the target
+
+Permission overwrites are applied right away, renames go through `RenameQueue`
+because Discord only allows two channel renames per 10 minutes per channel.
+
+In category mode, channels that are synced with their category and change to the
+same state in one batch can be grouped: the category's overwrite is updated once
+and each channel is re-synced in a single edit that also carries its rename. A
+group is only used when that takes fewer calls than handling the channels alone.
+"""
+
+import time
+from collections import deque
+from functools import partial
+from typing import Awaitable, Callable, NamedTuple, Optional, Union
+
+from disnake import CategoryChannel, PermissionOverwrite, TextChannel
+
+from bot import metrics
+from bot.scheduler.executor import ActionExecutor
+
+LOCKED = "🔴"
+UNLOCKED = "🟢"
+
+RENAME_MODES = ("immediate", "deferred", "off")
+
+
+class Plan(NamedTuple):
+    """What has to change on a channel to reach the lock/unlock target"""
+
+    send_messages: Optional[bool]
+    update_permissions: bool
+    name: str
+    rename: bool
+    # the @everyone overwrite to set, the current one with only send_messages changed
+    overwrite: PermissionOverwrite
+
+
+class CategoryPlan(NamedTuple):
+    """Lock or unlock a category's synced channels through the category overwrite"""
+
+    category: CategoryChannel
+    unlock: bool
+    send_messages: Optional[bool]
+    update_permissions: bool
+    channels: list[tuple[TextChannel, Plan]]
+    overwrite: PermissionOverwrite
+
+
+def status_name(name: str, unlock: bool) -> str:
+    """Returns the channel name wrapped in the lock or unlock marker"""
+    base = name.replace(LOCKED, "").replace(UNLOCKED, "")
+    mark = UNLOCKED if unlock else LOCKED
+    return f"{mark}{base}{mark}"
+
+
+def _overwrite(
+    channel: Union[TextChannel, CategoryChannel], send_messages: Optional[bool]
+) -> tuple[PermissionOverwrite, bool]:
+    """Returns the channel's @everyone overwrite with send_messages set, and
+    whether that changes it. Setting an overwrite replaces it as a whole, so its
+    other permissions are carried over"""
+
+    overwrite = channel.overwrites_for(channel.guild.default_role)
+    update = overwrite.send_messages != send_messages
+    overwrite.send_messages = send_messages
+    return overwrite, update
+
+
+def plan(channel: TextChannel, unlock: bool) -> Plan:
+    """Compare the channel's @everyone overwrite and name with the target state"""
+
+    send_messages = None if unlock else False
+    overwrite, update = _overwrite(channel, send_messages)
+    name = status_name(channel.name, unlock)
+
+    return Plan(send_messages, update, name, channel.name != name, overwrite)
+
+
+def group(
+    targets: list[tuple[TextChannel, bool]],
+    *,
+    ready: Callable[[TextChannel, str], bool],
+) -> tuple[list[CategoryPlan], list[tuple[TextChannel, bool]]]:
+    """Split (channel, unlock) targets into category plans and single channels
+
+    `ready` tells whether a channel's rename would be sent right away, only those
+    renames can ride along with the sync edit and save a call"""
+
+    groups: dict[tuple[int, bool], list[TextChannel]] = {}
+    singles = []
+    for channel, unlock in targets:
+        if channel.category is not None and channel.permissions_synced:
+            groups.setdefault((channel.category.id, unlock), []).append(channel)
+        else:
+            singles.append((channel, unlock))
+
+    plans = []
+    for (_, unlock), channels in groups.items():
+        category = channels[0].category
+        send_messages = None if unlock else False
+        overwrite, update = _overwrite(category, send_messages)
+
+        children = [(c, plan(c, unlock)) for c in channels]
+        renamed = [p.rename and ready(c, p.name) for c, p in children]
+
+        # a synced channel matches its category, so every channel needs a sync
+        # edit when the category changes and that edit can carry the rename
+        alone = sum(p.update_permissions + r for (_, p), r in zip(children, renamed))
+        grouped = update + sum(update or r for r in renamed)
+
+        if grouped < alone:
+            plans.append(
+                CategoryPlan(
+                    category, unlock, send_messages, update, children, overwrite
+                )
+            )
+        else:
+            singles.extend((c, unlock) for c in channels)
+
+    return plans, singles
+
+
+class RenameQueue:
+    """Coalesces channel renames and keeps every channel within Discord's rename
+    rate limit
+
+    Renames are queued, keeping only the latest target per channel, and flushed
+    per guild through the executor once the channel has budget left. In
+    `immediate` mode the caller flushes right after the batch that requested them,
+    so no permission overwrite waits on a rename, `deferred` waits for the
+    periodic flush and `off` never renames."""
+
+    def __init__(
+        self,
+        executor: ActionExecutor,
+        rename: Callable[[TextChannel, str], Awaitable[None]],
+        *,
+        mode: str = "immediate",
+        limit: int = 2,
+        period: float = 600,
+    ) -> None:
+        if mode not in RENAME_MODES:
+            raise ValueError(f"rename mode must be one of {', '.join(RENAME_MODES)}")
+
+        self.mode = mode
+        self.limit = limit
+        self.period = period
+        self._executor = executor
+        self._rename = rename
+        # guild_id -> channel_id -> (channel, target name)
+        self._pending: dict[int, dict[int, tuple[TextChannel, str]]] = {}
+        # channel_id -> monotonic times of recent renames
+        self._history: dict[int, deque] = {}
+
+    def __len__(self) -> int:
+        return sum(len(renames) for renames in self._pending.values())
+
+    def _allowed(self, channel_id: int, now: float) -> bool:
+        """True if the channel can be renamed without hitting the rate limit"""
+        history = self._history.get(channel_id)
+        if history is None:
+            return True
+
+        while history and history[0] <= now - self.period:
+            history.popleft()
+        return len(history) < self.limit
+
+    def discard(self, channel_id: int) -> None:
+        """Forget any queued rename for a channel"""
+        for renames in self._pending.values():
+            renames.pop(channel_id, None)
+
+    def ready(self, channel: TextChannel, name: str) -> bool:
+        """True if a rename of the channel would be sent right away"""
+        return (
+            self.mode == "immediate"
+            and channel.name != name
+            and self._allowed(channel.id, time.monotonic())
+        )
+
+    def take(self, channel: TextChannel, name: str) -> bool:
+        """Claim the channel's rename for an edit the caller is about to make
+        Returns False if the rename is not needed now, it is queued if it must wait"""
+
+        if self.mode == "off":
+            return False
+
+        self.discard(channel.id)
+
+        if channel.name == name:
+            metrics.DISCORD_SKIPPED.inc(route="edit")
+            return False
+
+        if self.ready(channel, name):
+            self._history.setdefault(channel.id, deque()).append(time.monotonic())
+            return True
+
+        self._pending.setdefault(channel.guild.id, {})[channel.id] = (channel, name)
+        return False
+
+    def request(self, channel: TextChannel, name: str) -> None:
+        """Queue the rename for the next flush, replacing any queued one"""
+
+        if self.mode == "off":
+            return
+
+        renames = self._pending.setdefault(channel.guild.id, {})
+        renames.pop(channel.id, None)
+
+        if channel.name == name:
+            metrics.DISCORD_SKIPPED.inc(route="edit")
+            return
+
+        renames[channel.id] = (channel, name)
+
+    async def flush(self, owns: Optional[Callable[[int], bool]] = None) -> int:
+        """Apply every queued rename that has rate budget left, returns the number sent
+        Renames of guilds that `owns` rejects are dropped, another process owns them.
+        Flushes may overlap, a rename counts against the budget once it is taken"""
+
+        now = time.monotonic()
+        actions = []
+
+        for guild_id, renames in list(self._pending.items()):
+            if owns is not None and not owns(guild_id):
+                del self._pending[guild_id]
+                continue
+
+            for channel_id, (channel, name) in list(renames.items()):
+                if channel.name == name:
+                    # a later transition already put the channel back
+                    del renames[channel_id]
+                    metrics.DISCORD_SKIPPED.inc(route="edit")
+                elif self._allowed(channel_id, now):
+                    del renames[channel_id]
+                    self._history.setdefault(channel_id, deque()).append(now)
+                    actions.append(
+                        (guild_id, channel_id, partial(self._rename, channel, name))
+                    )
+
+            if not renames:
+                del self._pending[guild_id]
+
+        # drop rate limit history that no longer restricts anything
+        expired = [
+            c for c, h in self._history.items() if not h or h[-1] <= now - self.period
+        ]
+        for channel_id in expired:
+            del self._history[channel_id]
+
+        results = await self._executor.run(actions)
+        for result in results:
+            if result.error is not None:
+                print(f"Failed to rename channel {result.key}: {result.error!r}")
+
+        return len(actions)
@@ -0,0 +1,285 @@
+"""Deadline scheduler for channel lock/unlock transitions"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Iterable, NamedTuple, Optional
+
+from bot import metrics
+from bot.config import cache
+from bot.config.cache import ChannelConfig
+from bot.scheduler import timetable, tzcache
+from bot.scheduler import vectorized as _vectorized
+
+# upper bound on a single sleep so wall clock adjustments are picked up
+MAX_SLEEP = 300
+
+
+class Transition(NamedTuple):
+    """A lock or unlock that is due for a configured channel"""
+
+    channel: ChannelConfig
+    unlock: bool
+    when: int
+
+
+def _instants(
+    channel: ChannelConfig, zone: Optional[str], day: date
+) -> list[tuple[int, bool]]:
+    """Returns the channel's (epoch, unlock) instants on a local date"""
+    return [
+        (tzcache.instant(zone, day, seconds), unlock)
+        for seconds, unlock in timetable.transitions(channel, day)
+    ]
+
+
+def next_transition(
+    channel: ChannelConfig, zone: Optional[str], after: float
+) -> Optional[tuple[int, bool]]:
+    """Returns the next (epoch, unlock) pair for the channel strictly after `after`,
+    or None if the channel has nothing to schedule"""
+
+    today = tzcache.local_date(zone, after)
+
+    for offset in range(8):
+        candidates = [
+            c
+            for c in _instants(channel, zone, today + timedelta(days=offset))
+            if c[0] > after
+        ]
+
+        if candidates:
+            return min(candidates)
+
+    return None
+
+
+def previous_transition(
+    channel: ChannelConfig, zone: Optional[str], before: float
+) -> Optional[tuple[int, bool]]:
+    """Returns the latest (epoch, unlock) pair for the channel at or before `before`,
+    or None if the channel has no transition in the past week"""
+
+    today = tzcache.local_date(zone, before)
+
+    for offset in range(8):
+        candidates = [
+            c
+            for c in _instants(channel, zone, today - timedelta(days=offset))
+            if c[0] <= before
+        ]
+
+        if candidates:
+            return max(candidates)
+
+    return None
+
+
+class Scheduler:
+    """Keeps the next lock/unlock instant of every configured channel in a min-heap
+    and sleeps until the earliest one is due
+
+    Channel and timezone data is read from `bot.config.cache`, the heap only holds
+    (instant, sequence, channel_id) entries."""
+
+    def __init__(
+        self,
+        callback: Callable[[list[Transition]], Awaitable[None]],
+        *,
+        vectorized: bool = True,
+    ) -> None:
+        self._callback = callback
+        # evaluate reconciliation with NumPy arrays when it is installed
+        self.vectorized = vectorized and _vectorized.available()
+        self._heap: list[tuple[float, int, int]] = []
+        # channel_id -> (when, seq, unlock) of the live heap entry
+        self._entries: dict[int, tuple[float, int, bool]] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        # serializes scheduled firing with reconciliation
+        self._firing = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Drop every scheduled channel"""
+        self._heap.clear()
+        self._entries.clear()
+        self._notify()
+
+    def load(self) -> None:
+        """Rebuild the schedule from every cached guild and channel"""
+        self.clear()
+
+        for guild in cache.guilds():
+            self.schedule_channels(guild.channels)
+
+    def schedule_channels(self, channel_ids: Iterable[int]) -> None:
+        """Add channels or recompute their next transitions in one go"""
+        for channel_id in channel_ids:
+            self._schedule(channel_id)
+
+        self._notify()
+
+    def schedule_guild(self, guild_id: int) -> None:
+        """Reschedule every channel of a guild, e.g. after a timezone change"""
+        guild = cache.get_guild(guild_id)
+
+        for channel_id in guild.channels if guild else ():
+            self._schedule(channel_id)
+
+        self._notify()
+
+    def schedule_channel(self, channel_id: int) -> None:
+        """Add a channel or recompute its next transition after a config change"""
+        self._schedule(channel_id)
+        self._notify()
+
+    def remove_channel(self, channel_id: int) -> None:
+        """Drop a channel from the schedule, its heap entry is discarded lazily"""
+        self._entries.pop(channel_id, None)
+        timetable.discard(channel_id)
+        self._notify()
+
+    def remove_channels(self, channel_ids: Iterable[int]) -> None:
+        """Drop several channels from the schedule, e.g. when the bot leaves a guild"""
+        for channel_id in channel_ids:
+            self._entries.pop(channel_id, None)
+            timetable.discard(channel_id)
+
+        self._notify()
+
+    def _schedule(self, channel_id: int, after: Optional[float] = None) -> None:
+        """Push the channel's next transition onto the heap"""
+        channel = cache.get_channel(channel_id)
+        guild = cache.get_guild(channel.guild) if channel else None
+
+        if guild is None:
+            self._entries.pop(channel_id, None)
+            return
+
+        nxt = next_transition(channel, guild.timezone, after or time.time())
+        if nxt is None:
+            self._entries.pop(channel_id, None)
+            return
+
+        when, unlock = nxt
+        seq = next(self._seq)
+        self._entries[channel_id] = (when, seq, unlock)
+        heapq.heappush(self._heap, (when, seq, channel_id))
+
+    def _notify(self) -> None:
+        """Wake the run loop so it re-evaluates the earliest deadline"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _pop_due(self, now: float) -> list[Transition]:
+        """Pop every live entry whose deadline has passed and reschedule it"""
+        due = []
+
+        while self._heap and self._heap[0][0] <= now:
+            when, seq, channel_id = heapq.heappop(self._heap)
+            entry = self._entries.get(channel_id)
+
+            if entry is None or entry[1] != seq:
+                # stale entry left behind by a reschedule or removal
+                continue
+
+            due.append(Transition(cache.get_channel(channel_id), entry[2], when))
+            self._schedule(channel_id, after=when)
+
+        return due
+
+    async def _fire(self, due: list[Transition]) -> None:
+        """Hand due transitions to the callback and persist the resulting statuses"""
+        async with self._firing:
+            start = time.perf_counter()
+            metrics.CHANNELS.inc(len(due), result="evaluated")
+
+            try:
+                await self._callback(due)
+            except Exception as e:
+                print(f"Scheduler callback failed: {e!r}")
+
+            try:
+                await cache.flush_channel_statuses()
+            except Exception as e:
+                print(f"Failed to persist channel statuses: {e!r}")
+
+            metrics.TICK_SECONDS.observe(time.perf_counter() - start)
+
+    def out_of_sync(
+        self, now: float, *, vectorized: Optional[bool] = None
+    ) -> list[Transition]:
+        """Returns a transition for every channel whose stored state differs
+        from the state its schedule says it should be in at `now`"""
+
+        batched = self.vectorized if vectorized is None else vectorized
+        due = []
+        if batched:
+            due = [
+                Transition(*due) for due in _vectorized.out_of_sync(cache.guilds(), now)
+            ]
+
+        for guild in cache.guilds():
+            for channel in guild.channels.values():
+                if batched and not channel.windows:
+                    # evaluated by the vectorized pass, windows are not
+                    continue
+
+                prev = previous_transition(channel, guild.timezone, now)
+                if prev is not None and prev[1] != channel.unlocked:
+                    due.append(Transition(channel, prev[1], prev[0]))
+
+        return due
+
+    async def fire(self, due: list[Transition]) -> None:
+        """Apply transitions that did not come from the schedule, e.g. replayed ones"""
+        if due:
+            await self._fire(due)
+
+    async def reconcile(self) -> int:
+        """Compute every channel's desired state from its schedule and fire the
+        channels whose stored state differs, e.g. after a restart or a resume.
+        Returns the number of channels that were out of sync"""
+
+        due = self.out_of_sync(time.time())
+        if due:
+            await self._fire(due)
+
+        return len(due)
+
+    async def tick(self, now: float) -> int:
+        """Fire every channel due at `now`, returns the number of due channels"""
+        due = self._pop_due(now)
+
+        if due:
+            await self._fire(due)
+
+        return len(due)
+
+    async def run(self) -> None:
+        """Sleep until the earliest deadline, fire the due channels, repeat"""
+        self._wakeup = asyncio.Event()
+
+        while True:
+            self._wakeup.clear()
+            if await self.tick(time.time()):
+                continue
+
+            timeout = MAX_SLEEP
+            while self._heap:
+                when, seq, channel_id = self._heap[0]
+                entry = self._entries.get(channel_id)
+                if entry is not None and entry[1] == seq:
+                    timeout = min(MAX_SLEEP, max(0, when - time.time()))
+                    break
+                heapq.heappop(self._heap)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
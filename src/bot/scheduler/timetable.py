@@ -0,0 +1,199 @@
+"""Per-channel timetables for channels with extra lock windows and exceptions
+
+A channel without windows only has its own lock/unlock times, which are looked
+up directly. Channels with windows get a `Timetable` built once per change: the
+undated transitions of the whole week in one sorted list, dated windows in an
+interval tree and exceptions as merged date ranges, so finding the transitions
+of a day takes O(log n) no matter how many windows are configured.
+"""
+
+import bisect
+from datetime import date, timedelta
+from typing import Optional
+
+from bot.config.cache import ChannelConfig, ScheduleWindow
+from bot.config.model import should_run
+
+DAY = 86400
+ONE_DAY = timedelta(days=1)
+
+
+class IntervalTree:
+    """Static centered interval tree over inclusive (start, end, item) intervals"""
+
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, intervals: list[tuple]) -> None:
+        points = sorted(p for start, end, _ in intervals for p in (start, end))
+        self.center = points[len(points) // 2]
+
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+
+        self.by_start = sorted(here, key=lambda i: i[0])
+        self.by_end = sorted(here, key=lambda i: i[1], reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def at(self, point) -> list:
+        """Returns the item of every interval containing the point"""
+        found = []
+        node = self
+
+        while node is not None:
+            if point < node.center:
+                for start, _, item in node.by_start:
+                    if start > point:
+                        break
+                    found.append(item)
+                node = node.left
+            elif point > node.center:
+                for _, end, item in node.by_end:
+                    if end < point:
+                        break
+                    found.append(item)
+                node = node.right
+            else:
+                found.extend(item for _, _, item in node.by_start)
+                break
+
+        return found
+
+
+def _overnight(window: ScheduleWindow) -> int:
+    """1 if the window unlocks on the day after it locks, else 0"""
+    return int(window.unlock <= window.lock)
+
+
+class Timetable:
+    """Transitions of one channel's own times, windows and exceptions"""
+
+    __slots__ = ("base", "windows", "weekly", "dated", "skip_starts", "skip_ends")
+
+    def __init__(self, channel: ChannelConfig) -> None:
+        self.base = (channel.lock, channel.unlock, channel.days_mask)
+        self.windows = channel.windows
+
+        # (second of the week, unlock, days since the transition's start day)
+        weekly: list[tuple[int, bool, int]] = []
+        dated: list[tuple[date, date, ScheduleWindow]] = []
+        skips: list[tuple[date, date]] = []
+
+        weekdays = [d for d in range(7) if should_run(channel.days_mask, d)]
+        for seconds, unlock in ((channel.lock, False), (channel.unlock, True)):
+            if seconds is not None:
+                weekly.extend((d * DAY + seconds, unlock, 0) for d in weekdays)
+
+        for window in channel.windows:
+            start = window.start_date or date.min
+            end = window.end_date or date.max
+
+            if window.exception:
+                skips.append((start, end))
+            elif window.lock is None or window.unlock is None:
+                continue
+            elif window.start_date is None and window.end_date is None:
+                offset = _overnight(window)
+                for d in range(7):
+                    if should_run(window.days_mask, d):
+                        weekly.append((d * DAY + window.lock, False, 0))
+                        weekly.append(
+                            (((d + offset) % 7) * DAY + window.unlock, True, offset)
+                        )
+            else:
+                dated.append((start, end, window))
+
+        weekly.sort()
+        self.weekly = weekly
+        self.dated = IntervalTree(dated) if dated else None
+
+        # merge the exceptions into disjoint ranges for a bisect lookup
+        merged: list[list[date]] = []
+        for start, end in sorted(skips):
+            if merged and (start - merged[-1][1]).days <= 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.skip_starts = [start for start, _ in merged]
+        self.skip_ends = [end for _, end in merged]
+
+    def skipped(self, day: date) -> bool:
+        """True if an exception suspends the schedule on the date"""
+        i = bisect.bisect_right(self.skip_starts, day) - 1
+        return i >= 0 and self.skip_ends[i] >= day
+
+    def day(self, day: date) -> list[tuple[int, bool]]:
+        """Returns the (seconds since local midnight, unlock) transitions on a date
+        A window's transitions belong to the day it locks on, for its weekdays,
+        date range and exceptions"""
+
+        weekday = day.weekday()
+        yesterday = day - ONE_DAY
+        skipped = (self.skipped(day), self.skipped(yesterday))
+
+        lo = bisect.bisect_left(self.weekly, (weekday * DAY,))
+        hi = bisect.bisect_left(self.weekly, ((weekday + 1) * DAY,))
+        found = [
+            (seconds - weekday * DAY, unlock)
+            for seconds, unlock, offset in self.weekly[lo:hi]
+            if not skipped[offset]
+        ]
+
+        if self.dated is None:
+            return found
+
+        if not skipped[0]:
+            for window in self.dated.at(day):
+                if should_run(window.days_mask, weekday):
+                    found.append((window.lock, False))
+                    if not _overnight(window):
+                        found.append((window.unlock, True))
+
+        if not skipped[1]:
+            for window in self.dated.at(yesterday):
+                if _overnight(window) and should_run(
+                    window.days_mask, yesterday.weekday()
+                ):
+                    found.append((window.unlock, True))
+
+        return found
+
+
+# channel_id -> timetable of the channels that have windows
+_timetables: dict[int, Timetable] = {}
+
+
+def transitions(channel: ChannelConfig, day: date) -> list[tuple[int, bool]]:
+    """Returns the channel's (seconds since local midnight, unlock) transitions
+    on a local date"""
+
+    if not channel.windows:
+        if not should_run(channel.days_mask, day.weekday()):
+            return []
+
+        return [
+            (seconds, unlock)
+            for seconds, unlock in ((channel.lock, False), (channel.unlock, True))
+            if seconds is not None
+        ]
+
+    table: Optional[Timetable] = _timetables.get(channel.channel_id)
+    if (
+        table is None
+        or table.windows is not channel.windows
+        or table.base != (channel.lock, channel.unlock, channel.days_mask)
+    ):
+        table = _timetables[channel.channel_id] = Timetable(channel)
+
+    return table.day(day)
+
+
+def discard(channel_id: int) -> None:
+    """Forget the timetable of a channel that is no longer scheduled"""
+    _timetables.pop(channel_id, None)
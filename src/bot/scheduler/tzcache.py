@@ -0,0 +1,74 @@
+"""Per-timezone cache of local day boundaries as UTC epoch seconds
+
+Every guild in the same zone shares the cached days, so resolving a configured
+time-of-day to a UTC instant is integer arithmetic on all but DST transition days.
+"""
+
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Optional
+
+import pytz
+
+# number of (zone, date) entries kept before the oldest are evicted
+MAX_DAYS = 4096
+
+# (zone, date) -> (start, end, offset), offset is None on a DST transition day
+_days: dict[tuple[str, date], tuple[int, int, Optional[int]]] = {}
+# zone -> (start, end, date) of the local day last looked up by local_date
+_current: dict[str, tuple[int, int, date]] = {}
+
+
+@lru_cache(maxsize=None)
+def get_timezone(zone: Optional[str]) -> pytz.BaseTzInfo:
+    """Returns the pytz timezone for a zone name, UTC if None"""
+    return pytz.timezone(zone or "UTC")
+
+
+def _day(zone: Optional[str], day: date) -> tuple[int, int, Optional[int]]:
+    """Returns the UTC epoch bounds of a local day and its fixed utc offset"""
+
+    key = (zone, day)
+    cached = _days.get(key)
+    if cached is not None:
+        return cached
+
+    tz = get_timezone(zone)
+    start = tz.localize(datetime.combine(day, time()))
+    end = tz.localize(datetime.combine(day + timedelta(days=1), time()))
+
+    offset = start.utcoffset()
+    fixed = int(offset.total_seconds()) if offset == end.utcoffset() else None
+
+    if len(_days) >= MAX_DAYS:
+        # dicts keep insertion order, so this drops the oldest day
+        del _days[next(iter(_days))]
+
+    cached = _days[key] = (int(start.timestamp()), int(end.timestamp()), fixed)
+    return cached
+
+
+def local_date(zone: Optional[str], epoch: float) -> date:
+    """Returns the local date in the zone at a UTC epoch"""
+
+    current = _current.get(zone)
+    if current is not None and current[0] <= epoch < current[1]:
+        return current[2]
+
+    day = datetime.fromtimestamp(epoch, get_timezone(zone)).date()
+    start, end, _ = _day(zone, day)
+    _current[zone] = (start, end, day)
+    return day
+
+
+def instant(zone: Optional[str], day: date, seconds: int) -> int:
+    """Returns the UTC epoch of a local time-of-day (in seconds) on a local date"""
+
+    start, _, offset = _day(zone, day)
+    if offset is not None:
+        return start + seconds
+
+    # DST transition day, let pytz resolve the wall clock time
+    tz = get_timezone(zone)
+    local = datetime.combine(day, time()) + timedelta(seconds=seconds)
+    return int(tz.normalize(tz.localize(local)).timestamp())
@@ -0,0 +1,107 @@
+"""Batch evaluation of every channel's desired lock state with NumPy
+
+`Scheduler.reconcile` has to evaluate the schedule of every configured channel.
+Here the schedules of each timezone are held in parallel arrays and the latest
+transition of every channel is found with a handful of array operations per
+day, instead of one Python call per channel. NumPy is optional, `available()` is
+False when it is not installed and the scheduler keeps its per-channel loop.
+"""
+
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from bot.config.cache import ChannelConfig, GuildConfig
+from bot.scheduler import tzcache
+
+try:
+    import numpy as np
+except ImportError:  # optional, install the "fast" extra
+    np = None
+
+
+def available() -> bool:
+    """True if NumPy is installed"""
+    return np is not None
+
+
+class ScheduleArrays:
+    """Schedules of every channel in one timezone as parallel arrays
+    Missing lock/unlock times are stored as -1"""
+
+    __slots__ = ("zone", "channels", "lock", "unlock", "mask", "unlocked")
+
+    def __init__(self, zone: Optional[str], channels: list[ChannelConfig]) -> None:
+        self.zone = zone
+        self.channels = channels
+        self.lock = np.array(
+            [-1 if c.lock is None else c.lock for c in channels], dtype=np.int64
+        )
+        self.unlock = np.array(
+            [-1 if c.unlock is None else c.unlock for c in channels], dtype=np.int64
+        )
+        self.mask = np.array([c.days_mask for c in channels], dtype=np.int64)
+        self.unlocked = np.array([c.unlocked for c in channels], dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def latest(self, now: float) -> tuple["np.ndarray", "np.ndarray"]:
+        """Returns the epoch and unlock flag of every channel's latest transition
+        at or before `now`, the epoch is -1 when there was none in the past week"""
+
+        best = np.full(len(self), -1, dtype=np.int64)
+        best_unlock = np.zeros(len(self), dtype=bool)
+        today = tzcache.local_date(self.zone, now)
+
+        # resolve each distinct time-of-day once per day, not once per channel
+        times = [
+            (seconds, *np.unique(seconds, return_inverse=True), unlock)
+            for seconds, unlock in ((self.lock, False), (self.unlock, True))
+        ]
+
+        for offset in range(8):
+            day = today - timedelta(days=offset)
+            runs = (self.mask >> day.weekday()) & 1 == 1
+
+            for seconds, unique, inverse, unlock in times:
+                lookup = np.array(
+                    [tzcache.instant(self.zone, day, int(s)) for s in unique],
+                    dtype=np.int64,
+                )
+                when = lookup[inverse.reshape(-1)]
+
+                # an unlock wins a tie with a lock at the same instant
+                newer = when >= best if unlock else when > best
+                better = runs & (seconds >= 0) & (when <= now) & newer
+                best = np.where(better, when, best)
+                best_unlock = np.where(better, unlock, best_unlock)
+
+        return best, best_unlock
+
+
+def build(guilds: Iterable[GuildConfig]) -> list[ScheduleArrays]:
+    """Group the channels of every guild into arrays per timezone
+    Channels with lock windows or exceptions are left to the per-channel path"""
+
+    zones: dict[Optional[str], list[ChannelConfig]] = {}
+    for guild in guilds:
+        channels = [c for c in guild.channels.values() if not c.windows]
+        if channels:
+            zones.setdefault(guild.timezone, []).extend(channels)
+
+    return [ScheduleArrays(zone, channels) for zone, channels in zones.items()]
+
+
+def out_of_sync(
+    guilds: Iterable[GuildConfig], now: float
+) -> list[tuple[ChannelConfig, bool, int]]:
+    """Returns (channel, unlock, when) for every channel without windows whose
+    stored state differs from the state its schedule says it should be in at `now`"""
+
+    due = []
+    for arrays in build(guilds):
+        when, unlock = arrays.latest(now)
+        for i in np.flatnonzero((when >= 0) & (unlock != arrays.unlocked)):
+            due.append((arrays.channels[i], bool(unlock[i]), int(when[i])))
+
+    return due
@@ -0,0 +1,14 @@
+"""Startup phase timings, measured from the moment the bot package is imported"""
+
+import time
+
+_start = time.perf_counter()
+
+# phase name -> seconds since start
+phases: dict[str, float] = {}
+
+
+def mark(phase: str) -> None:
+    """Record that a startup phase has completed"""
+    phases[phase] = time.perf_counter() - _start
+    print(f"Startup: {phase} after {phases[phase]:.2f}s")
@@ -2,34 +2,33 @@
 
 import asyncio
 import os
-import time
 
-from bot.config import model
+from bot import startup
+from bot.config import migrations, model
 
 
 def db_file_exists():
     """Check if db file exists"""
-    path = "./bot/config/config.sqlite3"
+    path = model.engine.url.database
     cwd = os.getcwd()
     print("Checking DB file...")
 
     if not os.path.exists(path):
-        print(f'DB File not found - creating "{cwd}/bot/config/config.sqlite3"...')
+        print(f'DB File not found - creating "{os.path.join(cwd, path)}"...')
         open(path, "w+").close()
         print(f"DB file created")
         return False
 
     else:
-        print("DB file Found, skipping DB initialization")
+        print("DB file Found, migrating existing database")
         return True
 
 
 async def init_db():
-    """Create db tables and columns"""
+    """Create db tables and columns, or migrate an existing database in place"""
     print("Initializing database...")
-    time.sleep(1.5)
-    await model.create()
-    print("Database initialized - tables created...")
+    await migrations.migrate()
+    print("Database initialized - schema is up to date...")
 
 
 def token_check():
@@ -42,12 +41,13 @@ def pre_check():
     """main pre-check function"""
 
     print("======Starting Pre-check process =====")
-    time.sleep(1)
-    if not db_file_exists():
-        time.sleep(2)
-        asyncio.run(init_db())
+    # server databases are created by their admin, SQLite needs the file
+    if model.engine.dialect.name == "sqlite":
+        db_file_exists()
+
+    asyncio.run(init_db())
+    startup.mark("db init")
 
-    time.sleep(1)
     if not token_check():
         print(
             "Token was not supplied. Please make sure the token is valid and provided in the token.env file"
@@ -0,0 +1,70 @@
+"""Launch the bot as several processes, each running a slice of the shards
+
+usage: python launcher.py --processes 2 --shards 8
+"""
+
+import argparse
+import multiprocessing
+import os
+
+
+def run_worker(shard_ids: list[int], shard_count: int) -> None:
+    """Entry point of a worker process, runs the bot for its shards"""
+
+    # settings are read on import, so set them before importing the bot
+    os.environ["SHARD_IDS"] = ",".join(str(i) for i in shard_ids)
+    os.environ["SHARD_COUNT"] = str(shard_count)
+
+    from bot import bot
+    from main import main
+
+    main(bot)
+
+
+def split_shards(shard_count: int, processes: int) -> list[list[int]]:
+    """Split the shard IDs as evenly as possible between the processes"""
+    return [list(range(shard_count))[i::processes] for i in range(processes)]
+
+
+def launch(shard_count: int, processes: int) -> None:
+    """Start one worker per process and wait for all of them to exit"""
+
+    # spawn so every worker imports the bot with its own environment
+    context = multiprocessing.get_context("spawn")
+    workers = []
+
+    for shard_ids in split_shards(shard_count, processes):
+        worker = context.Process(
+            target=run_worker,
+            args=(shard_ids, shard_count),
+            name=f"shards-{shard_ids[0]}-{shard_ids[-1]}",
+        )
+        worker.start()
+        print(f"Started worker {worker.name} (pid {worker.pid}) for shards {shard_ids}")
+        workers.append(worker)
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, required=True, help="total shard count")
+    parser.add_argument(
+        "--processes", type=int, default=1, help="number of worker processes"
+    )
+    args = parser.parse_args()
+
+    if not 0 < args.processes <= args.shards:
+        parser.error("--processes must be between 1 and --shards")
+
+    # imported here, spawned workers re-import this module and must not read the
+    # bot's settings before run_worker has set their shards
+    from check import pre_check
+
+    pre_check()
+    launch(args.shards, args.processes)
@@ -1,5 +1,4 @@
 import os
-import time
 
 from dotenv import load_dotenv
 
@@ -17,6 +16,5 @@ def main(bot):
 
 if __name__ == "__main__":
     pre_check()
-    time.sleep(0.5)
 
     main(bot)
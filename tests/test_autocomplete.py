@@ -0,0 +1,53 @@
+from bot.cogs.helper.autocomplete import ChannelNameIndex
+
+GUILD = 1
+
+
+def index(*channels) -> ChannelNameIndex:
+    names = ChannelNameIndex()
+    names.build(GUILD, channels)
+    return names
+
+
+def test_search_puts_prefixes_first():
+    names = index((1, "off-topic"), (2, "General"), (3, "🔴general-2🔴"), (4, "gen"))
+
+    assert list(names.search(GUILD, "GEN").values()) == ["4", "2", "3"]
+    assert list(names.search(GUILD, "top").values()) == ["1"]
+    assert list(names.search(GUILD, "").values()) == ["4", "2", "3", "1"]
+    assert names.search(GUILD, "general", limit=1) == {"General": "2"}
+
+
+def test_search_tells_same_named_channels_apart():
+    names = index((1, "general"), (2, "general"))
+    assert names.search(GUILD, "gen") == {"general": "1", "general (2)": "2"}
+
+
+def test_find_ignores_case_and_markers():
+    names = index((1, "🟢General🟢"), (2, "general"), (3, "general-2"))
+    assert names.find(GUILD, "🔴GENERAL🔴") == [1, 2]
+    assert names.find(GUILD, "gen") == []
+
+
+def test_add_and_discard_keep_the_index_sorted():
+    names = index((1, "b"), (2, "d"))
+
+    names.add(GUILD, 3, "a")
+    names.add(GUILD, 2, "c")  # renamed
+    names.discard(GUILD, 1)
+    names.discard(GUILD, 99)
+
+    assert list(names.search(GUILD, "").items()) == [("a", "3"), ("c", "2")]
+    assert names.find(GUILD, "d") == []
+
+
+def test_guilds_are_indexed_only_once_built():
+    names = ChannelNameIndex()
+
+    names.add(GUILD, 1, "general")
+    assert GUILD not in names and names.search(GUILD, "gen") == {}
+
+    names.build(GUILD, [(1, "general")])
+    assert GUILD in names
+    names.forget(GUILD)
+    assert GUILD not in names and names.find(GUILD, "general") == []
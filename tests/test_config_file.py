@@ -0,0 +1,132 @@
+import json
+from datetime import date, time
+from types import SimpleNamespace
+
+import pytest
+from disnake import TextChannel
+
+from bot.cogs.helper import config_file
+from bot.cogs.helper.config_file import ConfigFileError, parse
+
+
+def text_channel(channel_id: int, name: str) -> TextChannel:
+    channel = TextChannel.__new__(TextChannel)
+    channel.id, channel.name = channel_id, name
+    return channel
+
+
+CHANNELS = {1: text_channel(1, "general"), 2: text_channel(2, "off-topic")}
+GUILD = SimpleNamespace(
+    id=10, get_channel=CHANNELS.get, text_channels=list(CHANNELS.values())
+)
+
+
+def errors(data, filename="config.json") -> list[str]:
+    if not isinstance(data, bytes):
+        data = json.dumps(data).encode()
+    with pytest.raises(ConfigFileError) as e:
+        parse(GUILD, filename, data)
+    return e.value.errors
+
+
+def test_parse_json_and_csv():
+    document = {
+        "timezone": "Europe/Berlin",
+        "category_mode": True,
+        "channels": [
+            {"channel_id": 1, "time_lock": "22:00", "time_unlock": "6:00"},
+            {
+                "channel": "#off-topic",
+                "days": "0-4",
+                "windows": [{"start_date": "2022-12-24", "exception": True}],
+            },
+        ],
+    }
+    parsed = parse(GUILD, "config.json", json.dumps(document).encode())
+    assert parsed.timezone == "Europe/Berlin" and parsed.category_mode is True
+    assert [tuple(row) for row in parsed.channels] == [
+        (1, time(22), time(6), None),
+        (2, None, None, "0-4"),
+    ]
+    # a single day exception, and no windows given for the first channel
+    (window,) = parsed.windows[2]
+    assert (window.start_date, window.end_date) == (date(2022, 12, 24),) * 2
+    assert 1 not in parsed.windows
+
+    csv = b"\xef\xbb\xbfchannel_id,channel,time_lock,time_unlock,days\n1,,22:00,,\n"
+    parsed = parse(GUILD, "config.CSV", csv)
+    assert parsed.timezone is None and parsed.category_mode is None
+    assert [tuple(row) for row in parsed.channels] == [(1, time(22), None, None)]
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        (b"\xff\xfe", "File is not UTF-8 text"),
+        (b"{", "File is not valid JSON"),
+        (b"[]", 'JSON must be an object with a "channels" list'),
+        (b'{"channels": {}}', 'JSON must be an object with a "channels" list'),
+    ],
+)
+def test_unreadable_files(data, error):
+    (message,) = errors(data)
+    assert message.startswith(error)
+
+
+def test_file_too_large(monkeypatch):
+    monkeypatch.setattr(config_file, "MAX_BYTES", 10)
+    assert errors({"channels": []}) == ["File is larger than 0KB"]
+
+
+def test_too_many_channels(monkeypatch):
+    monkeypatch.setattr(config_file, "MAX_CHANNELS", 1)
+    document = {"channels": [{"channel_id": 1}, {"channel_id": 2}]}
+    assert errors(document) == ["File lists more than 1 channels"]
+
+
+def test_every_problem_is_listed():
+    document = {
+        "timezone": "Mars/Olympus",
+        "category_mode": "yes",
+        "channels": [
+            "general",
+            {"channel_id": 3},
+            {"channel": "voice"},
+            {"channel_id": 1, "time_lock": "25:00", "days": "someday"},
+            {"channel_id": 2},
+            {"channel_id": "2"},
+        ],
+    }
+    assert errors(document) == [
+        "timezone 'Mars/Olympus' is not a supported timezone",
+        "category_mode must be true or false",
+        "row 1: not an object",
+        "row 2: no text channel 3",
+        "row 3: no text channel voice",
+        "row 4: time_lock '25:00' is not a 24-hour hour:minutes time",
+        "row 4: days 'someday' is not a range or list of weekdays",
+        "row 6: channel 2 is listed twice",
+    ]
+
+
+def test_bad_windows():
+    windows = [
+        "weekends",
+        {"time_lock": "1:00"},
+        {"exception": True},
+        {"exception": "no", "end_date": "someday"},
+    ]
+    document = {
+        "channels": [
+            {"channel_id": 1, "windows": windows},
+            {"channel_id": 2, "windows": {}},
+        ]
+    }
+    assert errors(document) == [
+        "row 1 window 1: not an object",
+        "row 1 window 2: a window needs a time_lock and time_unlock",
+        "row 1 window 3: an exception needs a start_date",
+        "row 1 window 4: exception must be true or false",
+        "row 1 window 4: end_date 'someday' is not valid",
+        "row 2: windows must be a list",
+    ]
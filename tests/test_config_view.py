@@ -0,0 +1,73 @@
+from datetime import time
+from types import SimpleNamespace
+
+from bot.cogs.helper import config_view
+from bot.config.cache import ChannelConfig, GuildConfig
+
+
+def guild(names: dict[int, str]) -> SimpleNamespace:
+    """A Discord guild with text channels of the given names"""
+    channels = {i: SimpleNamespace(id=i, name=name) for i, name in names.items()}
+    return SimpleNamespace(id=1, name="guild", icon=None, get_channel=channels.get)
+
+
+def config(channel_ids) -> GuildConfig:
+    config = GuildConfig(id=1)
+    for i in channel_ids:
+        config.channels[i] = ChannelConfig(1, i, time(22), time(6))
+    return config
+
+
+def test_view_lists_deleted_channels_by_id():
+    pages = config_view.ConfigPages(guild({1: "general"}), config([1, 2]))
+
+    rows = pages.embed(0).fields[-1].value.splitlines()[3:]
+    assert [row.split()[0] for row in rows] == ["#general", "2"]
+
+
+def test_pages_fit_a_field_and_repeat_the_header():
+    channels = {i: f"channel-{i}" for i in range(1, 101)}
+    pages = config_view.ConfigPages(guild(channels), config(channels))
+
+    assert pages.has(0) and pages.has(1) and not pages.has(-1)
+    rows, index = [], 0
+    while pages.has(index):
+        embed = pages.embed(index)
+        value = embed.fields[-1].value
+        assert len(value) <= config_view.FIELD_LIMIT
+        assert embed.footer.text == f"Page {index + 1}"
+
+        lines = value.splitlines()
+        if index:
+            assert lines[:3] == header
+        header = lines[:3]
+        rows += [row.split()[0] for row in lines[3:]]
+        index += 1
+
+    assert rows == [f"#channel-{i}" for i in channels]
+    assert pages.embed(index - 1) is pages.embed(index - 1)
+
+
+def test_single_page_has_no_footer():
+    pages = config_view.ConfigPages(guild({1: "general"}), config([1]))
+    assert pages.has(0) and not pages.has(1)
+    assert not pages.embed(0).footer.text
+
+
+def test_views_are_rendered_again_once_stale():
+    views = config_view.ConfigViews()
+    discord, guild_config = guild({1: "general"}), config([1])
+
+    pages = views.get(discord, guild_config)
+    assert views.get(discord, guild_config) is pages
+
+    guild_config.version += 1
+    assert views.get(discord, guild_config) is not pages
+    pages = views.get(discord, guild_config)
+
+    discord.name = "renamed"
+    assert views.get(discord, guild_config) is not pages
+    pages = views.get(discord, guild_config)
+
+    views.discard(discord.id)
+    assert views.get(discord, guild_config) is not pages
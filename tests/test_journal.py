@@ -0,0 +1,108 @@
+import time
+
+from bot.config import cache, query
+from bot.scheduler import Scheduler, journal
+
+# guilds of shard 0 and shard 1 of 2
+SHARD_0 = 2 << 22
+SHARD_1 = 3 << 22
+
+
+def scheduler(fired: list, fail: set = frozenset()) -> Scheduler:
+    """A scheduler applying every transition but those of the `fail` channels"""
+
+    async def apply(transitions):
+        for t in transitions:
+            fired.append(t.channel.channel_id)
+            if t.channel.channel_id not in fail:
+                await cache.update_channel_status(
+                    t.channel.channel_id, is_unlocked=t.unlock
+                )
+
+    return Scheduler(apply, vectorized=False)
+
+
+async def pending() -> list[int]:
+    return [e.channel_id for e in await query.get_pending_journal_entries()]
+
+
+async def setup(channels: dict[int, int], shard_ids=None) -> None:
+    """Configure channel_id -> guild_id, journal a lock of each and cache the shards"""
+
+    now = int(time.time())
+    await query.add_guilds(set(channels.values()))
+    for channel_id, guild_id in channels.items():
+        await query.update_guild_channel(guild_id, channel_id=channel_id)
+    await query.add_journal_entries(
+        (guild_id, channel_id, False, now) for channel_id, guild_id in channels.items()
+    )
+    await cache.load(shard_ids, 2 if shard_ids is not None else None)
+
+
+def test_replay_leaves_other_shards_pending(db, run):
+    fired = []
+
+    async def replay():
+        await setup({1: SHARD_0, 2: SHARD_1}, shard_ids=[0])
+        replayed = await journal.replay(scheduler(fired), [0], 2)
+        return replayed, await pending()
+
+    assert run(replay()) == (1, [2])
+    assert fired == [1]
+
+
+def test_replay_leaves_uncached_guilds_pending(db, run):
+    fired = []
+
+    async def replay():
+        await setup({1: SHARD_0, 2: SHARD_1}, shard_ids=[1])
+        # unfiltered, the entry of the guild that is not cached is still skipped
+        await journal.replay(scheduler(fired))
+        return await pending()
+
+    assert run(replay()) == [1]
+    assert fired == [2]
+
+
+def test_replay_completes_stale_and_failed_entries(db, run):
+    fired = []
+
+    async def replay():
+        await setup({1: SHARD_0, 2: SHARD_0, 3: SHARD_0})
+        # channel 1 is already locked, channel 2 fails to lock
+        cache.get_channel(1).unlocked = False
+        replayed = await journal.replay(scheduler(fired, fail={2}), batch_size=1)
+        return replayed, await pending(), cache.get_channel(3).unlocked
+
+    assert run(replay()) == (2, [], False)
+    assert fired == [2, 3]
+
+
+def test_replay_leaves_unowned_guilds_pending(db, run):
+    fired = []
+
+    async def replay():
+        await setup({1: SHARD_0, 2: SHARD_1})
+        # a standby holding only shard 0's lease
+        replayed = await journal.replay(
+            scheduler(fired, fail={1}), owns=lambda guild_id: guild_id == SHARD_0
+        )
+        return replayed, await pending()
+
+    assert run(replay()) == (1, [2])
+    assert fired == [1]
+
+
+def test_replay_leaves_failed_entries_of_lost_leases_pending(db, run):
+    owned = {SHARD_0}
+
+    async def apply(transitions):
+        # the lease lapses while the action is applied
+        owned.clear()
+
+    async def replay():
+        await setup({1: SHARD_0})
+        await journal.replay(Scheduler(apply), owns=owned.__contains__)
+        return await pending()
+
+    assert run(replay()) == [1]
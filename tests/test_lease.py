@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bot.scheduler import lease
+from bot.scheduler.lease import Leases, lease_name
+
+# a guild on shard 1 and one on shard 0 of two
+ODD, EVEN = 1 << 22, 2 << 22
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A clock for the lease module, wall and monotonic time move together"""
+
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        lease,
+        "time",
+        SimpleNamespace(time=lambda: clock.now, monotonic=lambda: clock.now),
+    )
+    return clock
+
+
+def test_margin_must_be_shorter_than_ttl():
+    with pytest.raises(ValueError):
+        Leases("a", ttl=10, margin=10)
+
+
+def test_heartbeat_reports_gained_and_lost(db, run, clock):
+    a, b = Leases("a", ttl=10, margin=2), Leases("b", ttl=10, margin=2)
+
+    assert run(a.heartbeat([0, 1], 2)) == ({0, 1}, set())
+    assert a.held() == {0, 1} and a.owns(ODD) and a.owns(EVEN)
+    # held elsewhere
+    assert run(b.heartbeat([0, 1], 2)) == (set(), set())
+    assert not b.owns(ODD)
+
+    # renewed, nothing changes
+    clock.now += 5
+    assert run(a.heartbeat([0, 1], 2)) == (set(), set())
+
+    # only shard 0 renewed, shard 1 is taken over once its lease lapsed
+    clock.now += 5
+    assert run(a.heartbeat([0], 2)) == (set(), {1})
+    assert a.owns(EVEN) and not a.owns(ODD)
+    clock.now += 10
+    assert run(b.heartbeat([1], 2)) == ({1}, set())
+    assert b.owns(ODD)
+
+
+def test_holder_stops_acting_before_the_lease_lapses(db, run, clock):
+    a = Leases("a", ttl=10, margin=2)
+    run(a.heartbeat([0], 1))
+
+    clock.now += 7.9
+    assert a.owns(EVEN)
+    clock.now += 0.1
+    assert a.held() == set() and not a.owns(EVEN)
+
+    # still its own in the database, renewing counts as gained again
+    assert run(a.heartbeat([0], 1)) == ({0}, set())
+
+
+def test_a_new_shard_count_means_new_leases(db, run, clock):
+    a, b = Leases("a", ttl=10, margin=2), Leases("b", ttl=10, margin=2)
+    run(a.heartbeat([0, 1], 2))
+
+    assert lease_name(0, 1) != lease_name(0, 2)
+    assert run(b.heartbeat([0], 1)) == ({0}, set())
+    assert b.owns(ODD) and b.owns(EVEN)
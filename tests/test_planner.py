@@ -0,0 +1,145 @@
+from types import SimpleNamespace
+
+import pytest
+from disnake import PermissionOverwrite
+
+from bot.scheduler import ActionExecutor, RenameQueue, planner
+
+GUILD = SimpleNamespace(id=1, default_role="everyone")
+
+
+def channel(channel_id: int, name: str, **overwrite) -> SimpleNamespace:
+    """A text channel with an @everyone overwrite"""
+    return SimpleNamespace(
+        id=channel_id,
+        name=name,
+        guild=GUILD,
+        overwrites_for=lambda role: PermissionOverwrite(**overwrite),
+    )
+
+
+def queue(renamed: list, **options) -> RenameQueue:
+    async def rename(channel, name):
+        renamed.append((channel.id, name))
+        channel.name = name
+
+    return RenameQueue(ActionExecutor(), rename, **options)
+
+
+def test_plan_skips_what_is_already_in_place():
+    locked = channel(1, "🔴general🔴", send_messages=False)
+
+    assert planner.plan(locked, False)[:4] == (False, False, "🔴general🔴", False)
+    assert planner.plan(locked, True)[:4] == (None, True, "🟢general🟢", True)
+
+
+def test_plan_keeps_the_rest_of_the_overwrite():
+    private = channel(1, "general", view_channel=False, send_messages=False)
+
+    overwrite = planner.plan(private, True).overwrite
+    assert overwrite.view_channel is False and overwrite.send_messages is None
+
+    overwrite = planner.plan(private, False).overwrite
+    assert overwrite.view_channel is False and overwrite.send_messages is False
+
+
+def test_group_locks_synced_channels_through_the_category():
+    category = channel(10, "private", view_channel=False)
+    synced = []
+    for i in (1, 2, 3):
+        child = channel(i, f"c{i}", view_channel=False)
+        child.category, child.permissions_synced = category, True
+        synced.append((child, False))
+    loose = channel(4, "c4")
+    loose.category, loose.permissions_synced = category, False
+
+    plans, singles = planner.group(synced + [(loose, False)], ready=lambda c, n: True)
+
+    assert singles == [(loose, False)]
+    (plan,) = plans
+    assert plan.category is category and plan.update_permissions
+    assert [c.id for c, _ in plan.channels] == [1, 2, 3]
+    # synced children copy the category overwrite, which stays private
+    assert plan.overwrite.view_channel is False
+    assert plan.overwrite.send_messages is False
+
+
+def test_request_only_queues(run):
+    renamed = []
+    renames = queue(renamed)
+
+    renames.request(channel(1, "general"), "🔴general🔴")
+    assert renamed == [] and len(renames) == 1
+
+    assert run(renames.flush()) == 1
+    assert renamed == [(1, "🔴general🔴")] and len(renames) == 0
+
+
+def test_requests_coalesce_to_the_latest_target(run):
+    renamed = []
+    renames = queue(renamed)
+    general = channel(1, "🟢general🟢")
+
+    renames.request(general, "🔴general🔴")
+    renames.request(general, "🟢general🟢")
+    assert len(renames) == 0
+
+    renames.request(general, "🔴general🔴")
+    renames.request(channel(2, "other"), "🔴other🔴")
+    run(renames.flush())
+    assert sorted(renamed) == [(1, "🔴general🔴"), (2, "🔴other🔴")]
+
+
+def test_flush_keeps_each_channel_within_its_budget(run):
+    renamed = []
+    renames = queue(renamed, limit=2, period=600)
+    general = channel(1, "general")
+
+    for unlock in (False, True, False):
+        renames.request(general, planner.status_name(general.name, unlock))
+        run(renames.flush())
+
+    # the third rename waits for the budget
+    assert len(renamed) == 2 and len(renames) == 1
+    assert not renames.ready(general, "🟢general🟢")
+
+    renames.period = 0
+    run(renames.flush())
+    assert renamed[-1] == (1, "🔴general🔴")
+
+
+def test_flush_drops_renames_of_guilds_owned_elsewhere(run):
+    renamed = []
+    renames = queue(renamed)
+
+    renames.request(channel(1, "general"), "🔴general🔴")
+    assert run(renames.flush(lambda guild_id: False)) == 0
+    assert renamed == [] and len(renames) == 0
+
+
+def test_flush_logs_failed_renames(run, capsys):
+    async def rename(channel, name):
+        raise RuntimeError("rate limited")
+
+    renames = RenameQueue(ActionExecutor(), rename)
+    renames.request(channel(1, "general"), "🔴general🔴")
+
+    assert run(renames.flush()) == 1
+    assert "Failed to rename channel 1" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("mode, ready", [("immediate", True), ("deferred", False)])
+def test_take_claims_ready_renames(mode, ready):
+    renames = queue([], mode=mode)
+    general = channel(1, "general")
+
+    assert renames.take(general, "🔴general🔴") is ready
+    assert len(renames) == (0 if ready else 1)
+
+
+def test_off_mode_never_renames(run):
+    renamed = []
+    renames = queue(renamed, mode="off")
+
+    renames.request(channel(1, "general"), "🔴general🔴")
+    assert run(renames.flush()) == 0 and renamed == []
@@ -0,0 +1,143 @@
+from datetime import date, time
+
+from bot.config import migrations, query
+
+# real snowflakes, too large for a 32-bit integer
+GUILD = 947543739671412878
+CHANNEL = 947543739671412900
+
+
+def test_migrations_are_idempotent(db, run):
+    assert run(migrations.migrate()) == []
+
+
+def test_add_guilds_skips_existing(db, run):
+    run(query.add_guilds([GUILD, GUILD + 1]))
+    run(query.add_guilds([GUILD + 1, GUILD + 2, GUILD + 2]))
+
+    guilds = run(query.get_guild_configs())
+    assert sorted(g.id for g in guilds) == [GUILD, GUILD + 1, GUILD + 2]
+
+
+def test_import_guild_channels_upserts_and_removes(db, run):
+    run(
+        query.import_guild_channels(
+            GUILD,
+            [(CHANNEL, time(1), time(2), "0-4"), (CHANNEL + 1, None, None, None)],
+            timezone="UTC",
+        )
+    )
+    run(
+        query.import_guild_channels(
+            GUILD, [(CHANNEL, time(3), None, None)], remove=[CHANNEL + 1]
+        )
+    )
+
+    guild = run(query.get_guild_config(GUILD))
+    assert guild.timezone == "UTC"
+    assert [
+        (c.channel_id, c.time_lock, c.time_unlock, c.days_mask) for c in guild.channels
+    ] == [(CHANNEL, time(3), None, 0b1111111)]
+
+
+def test_import_guild_channels_replaces_listed_windows(db, run):
+    run(query.add_channel_schedule(GUILD, channel_id=CHANNEL, time_lock=time(1)))
+    run(query.add_channel_schedule(GUILD, channel_id=CHANNEL + 1, time_lock=time(2)))
+
+    exception = (None, None, None, date(2022, 12, 24), date(2022, 12, 26), True)
+    added = run(
+        query.import_guild_channels(
+            GUILD,
+            [(CHANNEL, None, None, None), (CHANNEL + 1, None, None, None)],
+            category_mode=True,
+            windows={CHANNEL: [exception]},
+        )
+    )
+    assert [(s.channel_id, s.exception) for s in added] == [(CHANNEL, True)]
+
+    schedules = run(query.get_channel_schedules(guild_id=GUILD))
+    assert [(s.channel_id, s.time_lock, s.end_date) for s in schedules] == [
+        (CHANNEL, None, date(2022, 12, 26)),
+        (CHANNEL + 1, time(2), None),
+    ]
+    assert run(query.get_guild_config(GUILD)).category_mode
+
+
+def test_stream_channel_schedules_by_shard(db, run):
+    # with two shards, shard 1 and shard 0
+    odd, even = 1 << 22, 2 << 22
+    run(query.add_guilds([odd, even, even + 1]))
+    run(query.update_guild_channel(odd, channel_id=1, time_lock=time(1)))
+    run(query.update_guild_channel(even, channel_id=2, time_lock=time(2)))
+    run(query.update_guild_channel(even, channel_id=3, time_unlock=time(3)))
+
+    async def collect():
+        return [
+            [tuple(row) for row in chunk]
+            async for chunk in query.stream_channel_schedules([0], 2, chunk_size=1)
+        ]
+
+    chunks = run(collect())
+    assert all(len(chunk) == 1 for chunk in chunks)
+
+    rows = [row for chunk in chunks for row in chunk]
+    assert sorted((row[0], row[3]) for row in rows if row[3]) == [(even, 2), (even, 3)]
+    # guilds without channels come with empty channel columns
+    assert (even + 1, None) in [(row[0], row[3]) for row in rows]
+
+
+def test_channel_statuses_complete_journal(db, run):
+    run(query.add_guild(GUILD))
+    for channel_id in (CHANNEL, CHANNEL + 1):
+        run(query.update_guild_channel(GUILD, channel_id=channel_id, time_lock=time(1)))
+
+    run(
+        query.add_journal_entries(
+            [(GUILD, CHANNEL, False, 100), (GUILD, CHANNEL + 1, True, 100)]
+        )
+    )
+    assert run(query.get_last_pending_journal_id()) is not None
+
+    run(query.update_channel_statuses([(CHANNEL, False), (CHANNEL + 1, True)]))
+
+    assert run(query.get_pending_journal_entries()) == []
+    guild = run(query.get_guild_config(GUILD))
+    assert {c.channel_id: c.unlocked for c in guild.channels} == {
+        CHANNEL: False,
+        CHANNEL + 1: True,
+    }
+
+
+def test_remove_guild_removes_channels_and_schedules(db, run):
+    run(query.add_guild(GUILD))
+    run(query.update_guild_channel(GUILD, channel_id=CHANNEL, time_lock=time(1)))
+    run(
+        query.add_channel_schedule(
+            GUILD,
+            channel_id=CHANNEL,
+            time_lock=time(5),
+            time_unlock=time(6),
+            days=None,
+            start_date=date(2024, 1, 1),
+            end_date=None,
+            exception=False,
+        )
+    )
+
+    run(query.remove_guild(GUILD))
+
+    assert run(query.get_channel_ids(GUILD)) == []
+    assert run(query.get_channel_schedules(guild_id=GUILD)) == []
+
+
+def test_leases_are_taken_over_only_once_lapsed(db, run):
+    names = ["shard:0/2", "shard:1/2"]
+
+    assert sorted(run(query.acquire_leases(names, "a", now=100, ttl=10))) == names
+    assert run(query.acquire_leases(names, "b", now=105, ttl=10)) == []
+    # renewed by its holder
+    assert sorted(run(query.acquire_leases(names, "a", now=108, ttl=10))) == names
+    assert run(query.acquire_leases(names, "b", now=117, ttl=10)) == []
+
+    assert sorted(run(query.acquire_leases(names, "b", now=119, ttl=10))) == names
+    assert run(query.acquire_leases(names, "a", now=120, ttl=10)) == []
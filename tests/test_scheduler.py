@@ -0,0 +1,182 @@
+import time
+from datetime import datetime, time as clock, timezone
+
+from bot.config import cache
+from bot.config.cache import ChannelConfig
+from bot.scheduler import Scheduler
+from bot.scheduler.scheduler import next_transition, previous_transition
+
+GUILD = 947543739671412878
+CHANNEL = 947543739671412900
+
+
+def epoch(*args) -> int:
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+
+def scheduler(fired: list) -> Scheduler:
+    """A scheduler whose callback applies and records every transition"""
+
+    async def apply(transitions):
+        for t in transitions:
+            fired.append((t.channel.channel_id, t.unlock, t.when))
+            await cache.update_channel_status(
+                t.channel.channel_id, is_unlocked=t.unlock
+            )
+
+    return Scheduler(apply, vectorized=False)
+
+
+async def configure(channel_id=CHANNEL, zone=None, **times) -> ChannelConfig:
+    await cache.add_guild(GUILD, zone)
+    await cache.update_guild_channel(GUILD, channel_id=channel_id, **times)
+    return cache.get_channel(channel_id)
+
+
+def test_next_and_previous_transition():
+    # Monday 2022-12-05 12:00 UTC, locked 22:00 to 06:00
+    channel = ChannelConfig(GUILD, CHANNEL, clock(22), clock(6))
+    noon = epoch(2022, 12, 5, 12)
+
+    assert next_transition(channel, None, noon) == (epoch(2022, 12, 5, 22), False)
+    assert previous_transition(channel, None, noon) == (epoch(2022, 12, 5, 6), True)
+
+    # strictly after and at or before
+    lock = epoch(2022, 12, 5, 22)
+    assert next_transition(channel, None, lock) == (epoch(2022, 12, 6, 6), True)
+    assert previous_transition(channel, None, lock) == (lock, False)
+
+
+def test_transitions_follow_days_and_timezone():
+    # Wednesdays only, 09:00 in New York across the start of DST on 2022-03-13
+    channel = ChannelConfig(GUILD, CHANNEL, clock(9), days="2", days_mask=0b100)
+    zone = "America/New_York"
+
+    before = epoch(2022, 3, 10)
+    assert next_transition(channel, zone, before) == (epoch(2022, 3, 16, 13), False)
+    assert previous_transition(channel, zone, before) == (epoch(2022, 3, 9, 14), False)
+
+
+def test_nothing_to_schedule():
+    channel = ChannelConfig(GUILD, CHANNEL)
+    assert next_transition(channel, None, time.time()) is None
+    assert previous_transition(channel, None, time.time()) is None
+
+
+def test_tick_fires_due_channels_and_reschedules(db, run):
+    fired = []
+    sched = scheduler(fired)
+
+    async def tick():
+        channel = await configure(time_lock=clock(22), time_unlock=clock(6))
+        sched.schedule_channel(CHANNEL)
+        when, unlock = next_transition(channel, None, time.time())
+
+        counts = [await sched.tick(when - 1), await sched.tick(when)]
+        # rescheduled to the transition after
+        after, _ = next_transition(channel, None, when)
+        counts.append(await sched.tick(after))
+        return counts, when, unlock, after
+
+    counts, when, unlock, after = run(tick())
+    assert counts == [0, 1, 1]
+    assert fired == [(CHANNEL, unlock, when), (CHANNEL, not unlock, after)]
+
+
+def test_config_change_reschedules(db, run):
+    fired = []
+    sched = scheduler(fired)
+
+    async def tick():
+        channel = await configure(time_lock=clock(22))
+        sched.schedule_channel(CHANNEL)
+        old, _ = next_transition(channel, None, time.time())
+
+        # moved an hour later, the old heap entry is stale
+        await cache.update_guild_channel(GUILD, channel_id=CHANNEL, time_lock=clock(23))
+        sched.schedule_channel(CHANNEL)
+        new, _ = next_transition(channel, None, time.time())
+
+        # whichever comes first, only the new transition fires
+        ticks = [new - 1, new, max(old, new)]
+        return [await sched.tick(when) for when in ticks], new
+
+    counts, new = run(tick())
+    assert counts == [0, 1, 0] and fired == [(CHANNEL, False, new)]
+
+
+def test_removed_channels_are_not_fired(db, run):
+    fired = []
+    sched = scheduler(fired)
+
+    async def tick():
+        channel = await configure(time_lock=clock(22))
+        sched.schedule_channel(CHANNEL)
+        when, _ = next_transition(channel, None, time.time())
+
+        sched.remove_channel(CHANNEL)
+        return await sched.tick(when), len(sched)
+
+    assert run(tick()) == (0, 0) and fired == []
+
+
+def test_reconcile_fires_channels_out_of_sync(db, run):
+    fired = []
+    sched = scheduler(fired)
+
+    async def reconcile():
+        # unlocked all day, one channel is left locked
+        await configure(CHANNEL, time_unlock=clock(0))
+        await configure(CHANNEL + 1, time_unlock=clock(0))
+        await cache.update_channel_status(CHANNEL, is_unlocked=False)
+
+        return await sched.reconcile(), await sched.reconcile()
+
+    assert run(reconcile()) == (1, 0)
+    assert [(c, unlock) for c, unlock, _ in fired] == [(CHANNEL, True)]
+
+
+def test_out_of_sync_compares_with_the_latest_transition(db, run):
+    now = epoch(2022, 12, 5, 12)
+
+    async def out_of_sync(vectorized):
+        # locked 22:00 to 06:00, so unlocked at noon
+        await configure(CHANNEL, time_lock=clock(22), time_unlock=clock(6))
+        await configure(CHANNEL + 1, time_lock=clock(22), time_unlock=clock(6))
+        await cache.update_channel_status(CHANNEL + 1, is_unlocked=False)
+        # nothing to go by, whatever its state
+        await configure(CHANNEL + 2)
+        await cache.update_channel_status(CHANNEL + 2, is_unlocked=False)
+
+        due = Scheduler(None).out_of_sync(now, vectorized=vectorized)
+        return [(t.channel.channel_id, t.unlock, t.when) for t in due]
+
+    for vectorized in (False, True):
+        assert run(out_of_sync(vectorized)) == [
+            (CHANNEL + 1, True, epoch(2022, 12, 5, 6))
+        ]
+
+
+def test_out_of_sync_follows_windows_and_exceptions(db, run):
+    now = epoch(2022, 12, 5, 12)
+
+    async def out_of_sync():
+        # a window locking 11:00 to 13:00, and a channel whose window is skipped
+        for channel_id in (CHANNEL, CHANNEL + 1):
+            await configure(channel_id, time_unlock=clock(0))
+            await cache.add_channel_schedule(
+                GUILD, channel_id=channel_id, time_lock=clock(11), time_unlock=clock(13)
+            )
+        await cache.add_channel_schedule(
+            GUILD,
+            channel_id=CHANNEL + 1,
+            start_date=datetime(2022, 12, 5).date(),
+            end_date=datetime(2022, 12, 5).date(),
+            exception=True,
+        )
+
+        due = Scheduler(None).out_of_sync(now, vectorized=True)
+        return [(t.channel.channel_id, t.unlock, t.when) for t in due]
+
+    # the skipped channel stays unlocked as it was after yesterday's window
+    assert run(out_of_sync()) == [(CHANNEL, False, epoch(2022, 12, 5, 11))]
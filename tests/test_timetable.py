@@ -0,0 +1,123 @@
+import random
+from datetime import date, time, timedelta
+
+import pytest
+
+from bot.config.cache import ChannelConfig, ScheduleWindow
+from bot.config.model import days_mask, should_run
+from bot.scheduler import timetable
+
+FIRST = date(2022, 12, 1)
+DAYS = 90
+
+
+def _seconds(t):
+    return None if t is None else t.hour * 3600 + t.minute * 60
+
+
+def _covers(window, day):
+    return (window.start_date or date.min) <= day <= (window.end_date or date.max)
+
+
+def reference(channel, day):
+    """The channel's transitions on the day, straight from the definitions"""
+
+    def skipped(d):
+        return any(w.exception and _covers(w, d) for w in channel.windows)
+
+    found = []
+    if should_run(channel.days_mask, day.weekday()) and not skipped(day):
+        for t, unlock in ((channel.time_lock, False), (channel.time_unlock, True)):
+            if t is not None:
+                found.append((_seconds(t), unlock))
+
+    for window in channel.windows:
+        if window.exception or window.lock is None or window.unlock is None:
+            continue
+        overnight = window.unlock <= window.lock
+
+        # the window's lock day, today or yesterday for an overnight unlock
+        for locks_on in (day, day - timedelta(days=1)):
+            if (
+                not _covers(window, locks_on)
+                or not should_run(window.days_mask, locks_on.weekday())
+                or skipped(locks_on)
+            ):
+                continue
+            if locks_on == day:
+                found.append((window.lock, False))
+                if not overnight:
+                    found.append((window.unlock, True))
+            elif overnight:
+                found.append((window.unlock, True))
+
+    return sorted(found)
+
+
+def _time(rng):
+    return rng.choice([None, time(rng.randrange(24), rng.choice([0, 30]))])
+
+
+def _days(rng):
+    return rng.choice([None, "0-4", "5-1", "3", "0,2,6"])
+
+
+def _date(rng):
+    return rng.choice([None, FIRST + timedelta(days=rng.randrange(DAYS))])
+
+
+def random_channel(rng, channel_id):
+    windows = []
+    for i in range(rng.randrange(6)):
+        start, end = sorted([_date(rng), _date(rng)], key=lambda d: d or date.max)
+        if rng.random() < 0.3:
+            windows.append(
+                ScheduleWindow(i, start_date=start, end_date=end, exception=True)
+            )
+            continue
+
+        days = _days(rng)
+        windows.append(
+            ScheduleWindow(
+                i,
+                _time(rng) or time(23),
+                _time(rng) or time(1),
+                days,
+                days_mask(days),
+                *(rng.choice([(None, None), (start, end)])),
+            )
+        )
+
+    days = _days(rng)
+    return ChannelConfig(
+        guild=1,
+        channel_id=channel_id,
+        time_lock=_time(rng),
+        time_unlock=_time(rng),
+        days=days,
+        days_mask=days_mask(days),
+        windows=tuple(windows),
+    )
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_transitions_match_reference(seed):
+    rng = random.Random(seed)
+    channel = random_channel(rng, seed)
+
+    for offset in range(DAYS):
+        day = FIRST + timedelta(days=offset)
+        assert sorted(timetable.transitions(channel, day)) == reference(channel, day)
+
+    timetable.discard(channel.channel_id)
+
+
+def test_timetable_is_rebuilt_when_windows_change():
+    day = date(2022, 12, 5)
+    channel = ChannelConfig(1, 1, windows=(ScheduleWindow(1, time(1), time(2)),))
+    assert timetable.transitions(channel, day) == [(3600, False), (7200, True)]
+
+    channel.windows = (ScheduleWindow(2, start_date=day, end_date=day, exception=True),)
+    assert timetable.transitions(channel, day) == []
+
+    timetable.discard(channel.channel_id)
@@ -0,0 +1,84 @@
+import random
+from datetime import datetime, time, timedelta, timezone
+
+import pytest
+
+from bot.config import cache, query
+from bot.scheduler import Scheduler
+
+pytest.importorskip("numpy")
+
+ZONES = [
+    None,
+    "America/New_York",
+    "Europe/Berlin",
+    "Australia/Lord_Howe",
+    "Asia/Kolkata",
+]
+# the instants below are Sundays, Sunday only channels last changed a week before
+DAYS = [None, "0-4", "5-1", "2", "6", "0,3,6"]
+# 02:30 does not exist on a spring forward day and 01:30 happens twice in the fall
+TIMES = [None, time(0), time(1, 30), time(2, 30), time(9), time(17, 45), time(23, 59)]
+
+# around the 2022 DST changes of New York, Berlin and Lord Howe
+INSTANTS = [
+    datetime(2022, month, day, hour, minute, tzinfo=timezone.utc).timestamp()
+    for month, day in ((3, 13), (3, 27), (4, 3), (10, 2), (10, 30), (11, 6))
+    for hour, minute in ((0, 0), (1, 30), (2, 45), (6, 30), (7, 15), (15, 0))
+]
+
+
+async def configure(rng: random.Random) -> None:
+    """Guilds in every zone with channels of random times, days and statuses"""
+
+    statuses = []
+    for g, zone in enumerate(ZONES):
+        guild_id = (g + 1) << 22
+        await query.add_guild(guild_id, zone)
+
+        channels = []
+        for c in range(40):
+            channel_id = guild_id + c
+            channels.append(
+                (channel_id, rng.choice(TIMES), rng.choice(TIMES), rng.choice(DAYS))
+            )
+            statuses.append((channel_id, rng.random() < 0.5))
+        await query.import_guild_channels(guild_id, channels)
+
+        # a few channels with windows, evaluated per channel by both paths
+        await query.add_channel_schedule(
+            guild_id, channel_id=guild_id, time_lock=time(2), time_unlock=time(3)
+        )
+
+    await query.update_channel_statuses(statuses)
+    await cache.load()
+
+
+def due(transitions) -> list[tuple[int, bool, int]]:
+    return sorted((t.channel.channel_id, t.unlock, t.when) for t in transitions)
+
+
+def test_vectorized_matches_loop(db, run):
+    run(configure(random.Random(17)))
+    scheduler = Scheduler(None)
+
+    for now in INSTANTS:
+        for offset in (0, 3600, 86400):
+            loop = due(scheduler.out_of_sync(now + offset, vectorized=False))
+            assert due(scheduler.out_of_sync(now + offset, vectorized=True)) == loop
+
+
+def test_vectorized_sees_every_channel_out_of_sync(db, run):
+    run(configure(random.Random(3)))
+    scheduler = Scheduler(None)
+    now = INSTANTS[0]
+
+    # flip every channel to the state its schedule says it is not in
+    for transition in scheduler.out_of_sync(now, vectorized=False):
+        transition.channel.unlocked = transition.unlock
+    for guild in cache.guilds():
+        for channel in guild.channels.values():
+            channel.unlocked = not channel.unlocked
+
+    loop = due(scheduler.out_of_sync(now, vectorized=False))
+    assert loop and due(scheduler.out_of_sync(now, vectorized=True)) == loop